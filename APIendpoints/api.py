@@ -1,54 +1,55 @@
-from flask import Blueprint, jsonify, request, abort, current_app
+from flask import Blueprint, Response, jsonify, request, abort, current_app, make_response
 import datetime
+import hashlib
+import hmac
+import logging
+import time
 from functools import wraps
-from typing import Union
-from werkzeug.security import generate_password_hash, check_password_hash
+from urllib.parse import urlencode
 import jwt
 from jwt import ExpiredSignatureError, InvalidTokenError
-from config import db
-
-
-def to_int(value: Union[None, str, int, float, bytes]) -> int:
-    """Safely convert a Value to int."""
-    if value is None:
-        return 0
-    if isinstance(value, int):
-        return value
-    if isinstance(value, float):
-        return int(value)
-    if isinstance(value, str):
-        return int(float(value)) if value else 0
-    if isinstance(value, bytes):
-        return int(value.decode()) if value else 0
-    return 0
-
-
-def to_float(value: Union[None, str, int, float, bytes]) -> float:
-    """Safely convert a Value to float."""
-    if value is None:
-        return 0.0
-    if isinstance(value, (int, float)):
-        return float(value)
-    if isinstance(value, str):
-        return float(value) if value else 0.0
-    if isinstance(value, bytes):
-        return float(value.decode()) if value else 0.0
-    return 0.0
-
-
-def to_str(value: Union[None, str, int, float, bytes]) -> str:
-    """Safely convert a Value to str."""
-    if value is None:
-        return ""
-    if isinstance(value, str):
-        return value
-    if isinstance(value, bytes):
-        return value.decode()
-    return str(value)
-
+from config import db, ADMIN_CACHE_TTL, METRICS_TOKEN, TOKEN_CACHE_SIZE
+from db_context import batch
+from dates import normalize_date
+from aggregates import (
+    LAST_MODIFIED_NOW,
+    aggregate_statements,
+    touch_user_statement,
+    user_totals_statement,
+)
+from grade_import import import_grades, iter_ndjson, iter_schulnetz
+from grade_math import Gradebook, GradeRow, SubjectRow, to_str
+from grade_stats import PERIODS, compute_stats
+from .cache import TTLCache, response_cache
+from .listing import GRADE_FIELDS, GradeQuery
+from .metrics import CONTENT_TYPE, request_metrics
+from .operations import BatchOperations
+from .passwords import HashingBusy, password_hasher
+from . import profiling
+from .serialization import encode, encode_rows
+
+
+logger = logging.getLogger(__name__)
 
 api_routes = Blueprint("api_routes", __name__)
 
+# Verified token -> claims, each entry expires together with its token
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=12 * 60 * 60)
+# (username, id) -> admin flag, kept short so revoked admins lose access quickly
+admin_cache = TTLCache(maxsize=1000, ttl=ADMIN_CACHE_TTL)
+
+
+def create_token(username, user_id):
+    return jwt.encode(
+        {
+            "username": username,
+            "exp": datetime.datetime.now(datetime.timezone.utc)
+            + datetime.timedelta(hours=12),
+            "id": user_id,
+        },
+        current_app.config["SECRET_KEY"],
+    )
+
 
 def generate_jwt(user, password):
     try:
@@ -60,49 +61,45 @@ def generate_jwt(user, password):
             password_hash = to_str(user_data["password"])
             user_id = user_data["id"]
             
-            if check_password_hash(password_hash, password):
-                token = jwt.encode(
-                    {
-                        "username": username,
-                        "exp": datetime.datetime.now(datetime.timezone.utc)
-                        + datetime.timedelta(hours=12),
-                        "id": user_id,
-                    },
-                    current_app.config["SECRET_KEY"],
-                )
-                return token
+            if password_hasher.verify(password_hash, password):
+                # Move old hashes to the configured method/cost on login
+                if password_hasher.needs_rehash(password_hash):
+                    db.execute(
+                        "UPDATE users SET password=? WHERE id=?",
+                        [password_hasher.hash(password), user_id],
+                    )
+                return create_token(username, user_id)
             else:
                 raise ValueError("Invalid username or password")
         else:
             raise ValueError("Invalid username or password")
-    except (ExpiredSignatureError, InvalidTokenError) as e:
-        print(e)
+    except (ExpiredSignatureError, InvalidTokenError):
+        logger.exception("Could not create a token for %s", user)
         abort(401, "Token error")
 
 
-# Function to get the name of a subject based on its ID
-def get_subject_name(subject_id, current_user):
-    result = db.execute(
-        "SELECT name FROM subjects WHERE id=? AND user_id=?",
-        [subject_id, current_user["id"]],
-    )
-    if result.rows and result.rows[0]:
-        return result.rows[0]["name"]
-    else:
-        return "Unknown"
+# Grade columns joined with the name of their subject, so listings need one query
+GRADE_WITH_SUBJECT_SQL = """SELECT g.id, g.name, g.grade, g.weight, g.date, g.details,
+    COALESCE(s.name, 'Unknown') AS subject
+FROM grades g
+LEFT JOIN subjects s ON s.id = g.subject_id AND s.user_id = g.user_id
+WHERE g.user_id=?"""
 
 
 def delete_user_data(user_id):
     try:
-        subject_result = db.execute("SELECT COUNT(*) as count FROM subjects WHERE user_id=?", [user_id])
-        subject_count = subject_result.rows[0]["count"]
-        
-        grade_result = db.execute("SELECT COUNT(*) as count FROM grades WHERE user_id=?", [user_id])
-        grade_count = grade_result.rows[0]["count"]
-        
-        db.execute("DELETE FROM grades WHERE user_id=?", [user_id])
-        db.execute("DELETE FROM subjects WHERE user_id=?", [user_id])
-        db.execute("DELETE FROM users WHERE id=?", [user_id])
+        with batch() as statements:
+            subject_result = statements.add("SELECT COUNT(*) as count FROM subjects WHERE user_id=?", [user_id])
+            grade_result = statements.add("SELECT COUNT(*) as count FROM grades WHERE user_id=?", [user_id])
+            statements.add("DELETE FROM grades WHERE user_id=?", [user_id])
+            statements.add("DELETE FROM subjects WHERE user_id=?", [user_id])
+            statements.add("DELETE FROM users WHERE id=?", [user_id])
+
+        response_cache.invalidate(user_id)
+        admin_cache.clear()
+
+        subject_count = statements.results[subject_result].rows[0]["count"]
+        grade_count = statements.results[grade_result].rows[0]["count"]
         
         return f"User deleted successfully with {subject_count} subjects, {grade_count} grades"
     except Exception as e:
@@ -128,6 +125,19 @@ def get_subject_id(subject_name, current_user):
             raise ValueError(f"Error inserting subject: {e}")
 
 
+# Function to verify a token, skipping the signature check for tokens that
+# were already verified and have not expired yet
+def decode_token(token):
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(
+            token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
+        )
+        ttl = claims["exp"] - time.time() if "exp" in claims else None
+        token_cache.set(token, claims, ttl)
+    return claims
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -136,9 +146,7 @@ def token_required(f):
             return jsonify({"success": False, "message": "Token is missing"}), 403
 
         try:
-            data = jwt.decode(
-                token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
-            )
+            data = decode_token(token)
             current_user = {"username": data["username"], "id": data["id"]}
         except (ExpiredSignatureError, InvalidTokenError):
             return (
@@ -159,11 +167,12 @@ def admin_token_required(f):
             return jsonify({"success": False, "message": "Token is missing"}), 403
 
         try:
-            data = jwt.decode(
-                token, current_app.config["SECRET_KEY"], algorithms=["HS256"]
-            )
+            data = decode_token(token)
             current_user = {"username": data["username"], "id": data["id"]}
             
+            if admin_cache.get((data["username"], data["id"])):
+                return f(current_user, *args, **kwargs)
+
             result = db.execute(
                 "SELECT username, id, admin FROM users WHERE username = ?",
                 [data["username"]],
@@ -191,6 +200,7 @@ def admin_token_required(f):
                     jsonify({"success": False, "message": "User is not admin"}),
                     403,
                 )
+            admin_cache.set((data["username"], data["id"]), True)
 
         except (ExpiredSignatureError, InvalidTokenError):
             return (
@@ -203,91 +213,131 @@ def admin_token_required(f):
     return admin_decorated
 
 
-# Function to update the average, points, and number of exams for each subject
-def update_subjects(current_user):
-    subjects_result = db.execute(
-        "SELECT id, name, weight FROM subjects WHERE user_id=?", [current_user["id"]]
-    )
-    subjects = subjects_result.rows
-    
-    for subject in subjects:
-        subject_id = subject["id"]
-        weight = to_float(subject["weight"])  # Get weight from database
+# Admins profile a single request by sending the X-Profile header (see
+# APIendpoints/profiling.py), other requests only pay for the header lookup
+@api_routes.before_request
+def start_profile():
+    if profiling.PROFILE_HEADER not in request.headers:
+        return None
+    # Only admins may take the profiler, so check before starting it
+    denied = admin_token_required(lambda current_user: None)()
+    if denied is not None:
+        return denied
+    # The check cached the token: evict it so that the route verifies it again
+    # under the profiler and the jwt time is not hidden by the token cache
+    token_cache.pop(request.headers.get("x-access-token"))
+    return profiling.start()
 
-        grades_result = db.execute(
-            "SELECT grade, weight FROM grades WHERE subject_id=? AND user_id=?",
-            [subject_id, current_user["id"]],
-        )
-        grades = grades_result.rows
-        
-        val = 0
-        sumer = 0
 
-        for grade in grades:
-            if grade["grade"] and grade["grade"] != 0:
-                val += to_float(grade["grade"]) * to_float(grade["weight"])
-                sumer += to_float(grade["weight"])
+@api_routes.after_request
+def finish_profile(response):
+    return profiling.finish(response)
 
-        average = round(val / sumer if sumer != 0 else 0, 3)
-        num_exams = len(grades) if grades else 0
-        points = round((average - 4) * 2, 3) if average > 4 else 0
 
-        if num_exams == 0:
-            db.execute(
-                "UPDATE subjects SET average=?, points=?, num_exams=?, weight=? WHERE id=?",
-                [None, None, None, weight, subject_id],
-            )
+@api_routes.teardown_request
+def abort_profile(error=None):
+    profiling.abort()
+
+
+def load_last_modified(current_user):
+    result = db.execute(
+        "SELECT last_modified FROM users WHERE id=?", [current_user["id"]]
+    )
+    if not result.rows or result.rows[0]["last_modified"] is None:
+        return None
+    return to_str(result.rows[0]["last_modified"])
+
+
+# Decorator for GET routes: answers 304 Not Modified when the client already
+# has the current version of the user's data (ETag), without building the
+# response. Must be placed below token_required.
+# There is no Last-Modified: HTTP dates have one second resolution, so
+# If-Modified-Since would miss writes made in the same second as the fetch.
+# The version is read from the database on every request (one lookup by
+# primary key) rather than from the per-process response cache, so another
+# worker's writes are seen at once, and cached response data of an older
+# version is dropped before the body is built. The ETag covers the path and
+# the sorted query parameters, so it only validates the resource it was sent
+# with.
+def conditional_response(f):
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        last_modified = load_last_modified(current_user)
+        response_cache.check_version(current_user["id"], last_modified)
+        query = urlencode(sorted(request.args.items(multi=True)))
+        etag = hashlib.sha256(
+            f"{current_user['id']}:{last_modified}:{request.path}?{query}".encode()
+        ).hexdigest()[:32]
+
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
         else:
-            db.execute(
-                "UPDATE subjects SET average=?, points=?, num_exams=?, weight=? WHERE id=?",
-                [average, points, num_exams, weight, subject_id],
-            )
-    
-    update_main(current_user)
+            response = make_response(f(current_user, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        return response
+
+    return decorated
+
+
+# Function to update the average, points, and number of exams of the user's
+# subjects (all of them, or only subject_ids) followed by the user totals.
+# Both steps are a single set-based statement each, sent in one batch.
+def update_subjects(current_user, subject_ids=None):
+    if subject_ids is not None:
+        subject_ids = {subject_id for subject_id in subject_ids if subject_id is not None}
+    with batch() as statements:
+        statements.extend(aggregate_statements(current_user["id"], subject_ids))
 
 
 # Function to update the total average, total points, and total number of exams in the main table
 def update_main(current_user):
-    subjects_result = db.execute(
-        "SELECT name, average, points, num_exams, weight FROM subjects WHERE user_id=?",
-        [current_user["id"]],
-    )
-    subjects = subjects_result.rows
+    db.execute(*user_totals_statement(current_user["id"]))
+
 
-    val = 0.0
-    sumer = 0.0
-    points = 0.0
-    for subject in subjects:
-        if subject["num_exams"] is None or subject["num_exams"] == "":
-            continue
-        else:
-            val += to_float(subject["average"]) * to_float(subject["weight"])
-            sumer += 1 * to_float(subject["weight"])
-            points += to_float(subject["points"]) * to_float(subject["weight"])
-    
-    total_average = round(val / sumer if sumer != 0 else 0, 3)
-    num_exams = sum([to_int(subject["num_exams"]) if subject["num_exams"] is not None else 0 for subject in subjects])
 
-    db.execute(
-        "UPDATE users SET total_average=?, total_points=?, total_exams=? WHERE id=?",
-        [total_average, points, num_exams, current_user["id"]],
+def load_subject(current_user, subject_id):
+    result = db.execute(
+        "SELECT id, name, average, points, num_exams, weight FROM subjects WHERE id=? AND user_id=?",
+        [subject_id, current_user["id"]],
     )
+    if not result.rows or not result.rows[0]:
+        return None
 
+    subject = result.rows[0]
+    grades_result = db.execute(
+        "SELECT id FROM grades WHERE subject_id=? AND user_id=?",
+        [subject_id, current_user["id"]],
+    )
+    grade_ids_list = [grade["id"] for grade in grades_result.rows]
+
+    return {
+        "id": subject["id"],
+        "name": subject["name"],
+        "average": subject["average"],
+        "points": subject["points"],
+        "num_exams": subject["num_exams"],
+        "weight": subject["weight"],
+        "grade_ids": grade_ids_list,
+    }
 
 
 # Route to get information about a specific subject
 @api_routes.route("/subjects/<int:subject_id>", methods=["GET"])
 @token_required
+@conditional_response
 def get_subject(current_user, subject_id):
     if not subject_id:
         return jsonify({"success": False, "message": "Subject ID is required"}), 400
     try:
-        result = db.execute(
-            "SELECT id, name, average, points, num_exams, weight FROM subjects WHERE id=? AND user_id=?",
-            [subject_id, current_user["id"]],
+        subject_list = response_cache.get_or_load(
+            current_user["id"],
+            f"subject:{subject_id}",
+            lambda: load_subject(current_user, subject_id),
         )
-        
-        if not result.rows or not result.rows[0]:
+        if subject_list is None:
             return (
                 jsonify(
                     {
@@ -297,23 +347,6 @@ def get_subject(current_user, subject_id):
                 ),
                 404,
             )
-        
-        subject = result.rows[0]
-        grades_result = db.execute(
-            "SELECT id FROM grades WHERE subject_id=? AND user_id=?",
-            [subject_id, current_user["id"]],
-        )
-        grade_ids_list = [grade["id"] for grade in grades_result.rows]
-        
-        subject_list = {
-            "id": subject["id"],
-            "name": subject["name"],
-            "average": subject["average"],
-            "points": subject["points"],
-            "num_exams": subject["num_exams"],
-            "weight": subject["weight"],
-            "grade_ids": grade_ids_list,
-        }
         return jsonify({"success": True, "subject": subject_list}), 200
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -331,12 +364,15 @@ def add_subject(current_user):
         except KeyError:
             weight = 1
 
-        result = db.execute(
-            "INSERT INTO subjects (name, weight, user_id) VALUES (?,?,?)",
-            [name, weight, current_user["id"]],
-        )
-        subject_id = result.last_insert_rowid
-        update_subjects(current_user)
+        with batch() as statements:
+            insert = statements.add(
+                "INSERT INTO subjects (name, weight, user_id) VALUES (?,?,?)",
+                [name, weight, current_user["id"]],
+            )
+            # A new subject has no grades yet, so no aggregates change
+            statements.add(*touch_user_statement(current_user["id"]))
+        subject_id = statements.results[insert].last_insert_rowid
+        response_cache.invalidate(current_user["id"])
         
         return (
             jsonify(
@@ -349,6 +385,9 @@ def add_subject(current_user):
             200,
         )
     except Exception as e:
+        # Subject names are unique per user (idx_subjects_user_name)
+        if "UNIQUE" in str(e):
+            return jsonify({"success": False, "message": "Subject already exists"}), 409
         return jsonify({"success": False, "message": str(e)}), 500
 
 
@@ -372,13 +411,17 @@ def update_subject(current_user, subject_id):
                 [name, subject_id, current_user["id"]],
             )
         
-        update_subjects(current_user)
+        update_main(current_user)
+        response_cache.invalidate(current_user["id"])
         
         return (
             jsonify({"success": True, "message": "Subject updated successfully"}),
             200,
         )
     except Exception as e:
+        # Subject names are unique per user (idx_subjects_user_name)
+        if "UNIQUE" in str(e):
+            return jsonify({"success": False, "message": "Subject already exists"}), 409
         return jsonify({"success": False, "message": str(e)}), 500
 
 
@@ -391,7 +434,8 @@ def delete_subject(current_user, subject_id):
             "DELETE FROM subjects WHERE id=? AND user_id=?",
             [subject_id, current_user["id"]],
         )
-        update_subjects(current_user)
+        update_main(current_user)
+        response_cache.invalidate(current_user["id"])
         
         return (
             jsonify({"success": True, "message": "Subject deleted successfully"}),
@@ -404,11 +448,12 @@ def delete_subject(current_user, subject_id):
 # Route to get information about a specific grade
 @api_routes.route("/grades/<int:grade_id>", methods=["GET"])
 @token_required
+@conditional_response
 def get_grade(current_user, grade_id):
     try:
         result = db.execute(
-            "SELECT id, name, grade, weight, date, details, subject_id FROM grades WHERE id=? AND user_id=?",
-            [grade_id, current_user["id"]],
+            GRADE_WITH_SUBJECT_SQL + " AND g.id=?",
+            [current_user["id"], grade_id],
         )
         
         if not result.rows or not result.rows[0]:
@@ -422,7 +467,7 @@ def get_grade(current_user, grade_id):
             "weight": grade["weight"],
             "date": grade["date"],
             "details": grade["details"],
-            "subject": get_subject_name(grade["subject_id"], current_user),
+            "subject": grade["subject"],
         }
         return jsonify({"success": True, "grade": grade_list}), 200
 
@@ -430,28 +475,43 @@ def get_grade(current_user, grade_id):
         return jsonify({"success": False, "message": str(e)}), 500
 
 
-# Route to get grades for a specific subject
+# Fields of the grades listed per subject, the subject is implied
+SUBJECT_GRADE_FIELDS = {
+    field: sql for field, sql in GRADE_FIELDS.items() if field != "subject"
+}
+
+
+def load_grades(where, args, query):
+    result = db.execute(*query.sql(where, args))
+    return query.page(result.rows)
+
+
+# Response of a grade listing, with the cursor of the next page when paginated
+def grades_response(query, grades_list, next_cursor):
+    body = {"success": True, "grades": grades_list}
+    if query.limit is not None:
+        body["next_cursor"] = next_cursor
+    return jsonify(body), 200
+
+
+# Route to get grades for a specific subject, see listing.py for the
+# pagination, filter and field parameters
 @api_routes.route("/subjects/<int:subject_id>/grades", methods=["GET"])
 @token_required
+@conditional_response
 def subject_grade(current_user, subject_id):
     try:
-        result = db.execute(
-            "SELECT id, name, grade, weight, date, details FROM grades WHERE subject_id=? AND user_id=?",
-            [subject_id, current_user["id"]],
+        query = GradeQuery(request.args, SUBJECT_GRADE_FIELDS)
+        grades_list, next_cursor = response_cache.get_or_load(
+            current_user["id"],
+            f"subject_grades:{subject_id}:{query.cache_key}",
+            lambda: load_grades(
+                "g.subject_id=? AND g.user_id=?", [subject_id, current_user["id"]], query
+            ),
         )
-        
-        grades_list = [
-            {
-                "id": grade["id"],
-                "name": grade["name"],
-                "grade": grade["grade"],
-                "weight": grade["weight"],
-                "date": grade["date"],
-                "details": grade["details"],
-            }
-            for grade in result.rows
-        ]
-        return jsonify({"success": True, "grades": grades_list}), 200
+        return grades_response(query, grades_list, next_cursor)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -460,11 +520,9 @@ def subject_grade(current_user, subject_id):
 @api_routes.route("/grades", methods=["POST"])
 @token_required
 def add_grade(current_user):
-    print("add grade")
     try:
         data = request.get_json()
-        print(data)
-        date = data.get("date")
+        date = normalize_date(data.get("date"))
         name = data.get("name")
         grade = data.get("grade")
         weight = data.get("weight")
@@ -490,47 +548,107 @@ def add_grade(current_user):
                 "message": ("New grade added successfully"),
             }
 
-        result = db.execute(
-            "INSERT INTO grades (date, name, grade, weight, details, subject_id, user_id) VALUES (?,?,?,?,?,?,?)",
-            [date, name, grade, weight, details, subject_id, current_user["id"]],
-        )
-        print(result)
+        with batch() as statements:
+            insert = statements.add(
+                "INSERT INTO grades (date, name, grade, weight, details, subject_id, user_id) VALUES (?,?,?,?,?,?,?)",
+                [date, name, grade, weight, details, subject_id, current_user["id"]],
+            )
+            statements.extend(aggregate_statements(current_user["id"], [subject_id]))
+        result = statements.results[insert]
         grade_id = result.last_insert_rowid
         message["id"] = grade_id
-        update_subjects(current_user)
+        response_cache.invalidate(current_user["id"])
         
         return (
             jsonify(message),
             200,
         )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        logger.exception("Could not add grade")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+# Route to import many grades at once, either as a schulNetz export (JSON) or
+# as NDJSON with one grade per line
+@api_routes.route("/grades/bulk", methods=["POST"])
+@token_required
+def bulk_add_grades(current_user):
+    try:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            records = iter_ndjson(request.stream)
+            subjects = ()
+        else:
+            data = request.get_json(silent=True)
+            if isinstance(data, list):
+                records = data
+                subjects = ()
+            elif isinstance(data, dict) and "grades" in data:
+                records = iter_schulnetz(data, data.get("skip_subjects", ()))
+                subjects = data.get("subjects", ())
+            else:
+                raise ValueError(
+                    "Expected a JSON list of grades, a schulNetz export with grades "
+                    "or NDJSON (Content-Type: application/x-ndjson)"
+                )
+
+        summary = import_grades(current_user["id"], records, subjects)
+        response_cache.invalidate(current_user["id"])
+        return (
+            jsonify(
+                {
+                    "success": True,
+                    "message": f"{summary['imported']} grades imported successfully",
+                    **summary,
+                }
+            ),
+            200,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+# Route to run several grade and subject operations in one transaction, with
+# one refresh of the aggregates at the end, see operations.py
+@api_routes.route("/batch", methods=["POST"])
+@token_required
+def run_batch(current_user):
+    try:
+        data = json_object()
+        operations = BatchOperations(current_user["id"], data.get("operations"))
+        with batch() as statements:
+            statements.extend(operations.statements)
+        response_cache.invalidate(current_user["id"])
+        return jsonify({"success": True, "results": operations.results(statements.results)}), 200
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
-        print(e)
+        # Subject names are unique per user (idx_subjects_user_name)
+        if "UNIQUE" in str(e):
+            return jsonify({"success": False, "message": "Subject already exists"}), 409
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+# Route to list the user's grades, see listing.py for the pagination,
+# filter and field parameters
 @api_routes.route("/grades", methods=["GET"])
 @token_required
+@conditional_response
 def get_grades(current_user):
     try:
-        result = db.execute(
-            "SELECT id, name, grade, weight, date, details, subject_id FROM grades WHERE user_id=?",
-            [current_user["id"]],
+        query = GradeQuery(request.args)
+        grades_list, next_cursor = response_cache.get_or_load(
+            current_user["id"],
+            f"grades:{query.cache_key}",
+            lambda: load_grades("g.user_id=?", [current_user["id"]], query),
         )
-        
-        grades_list = [
-            {
-                "id": grade["id"],
-                "name": grade["name"],
-                "grade": grade["grade"],
-                "weight": grade["weight"],
-                "date": grade["date"],
-                "details": grade["details"],
-                "subject": get_subject_name(grade["subject_id"], current_user),
-            }
-            for grade in result.rows
-        ]
-        return jsonify({"success": True, "grades": grades_list}), 200
+        return grades_response(query, grades_list, next_cursor)
 
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -553,6 +671,9 @@ def update_grade(current_user, grade_id):
                     400,
                 )
 
+        if "date" in data:
+            data["date"] = normalize_date(data["date"])
+
         # Get subject_id BEFORE popping from data
         if data.get("subject_id") is None:
             if data.get("subject_name") is not None:
@@ -573,17 +694,31 @@ def update_grade(current_user, grade_id):
         if subject_id:
             data["subject_id"] = subject_id
 
+        # Remember the current subject so both old and new subject get recomputed
+        affected_subjects = []
+        if subject_id is not None:
+            previous = db.execute(
+                "SELECT subject_id FROM grades WHERE id=? AND user_id=?",
+                [grade_id, current_user["id"]],
+            )
+            if previous.rows:
+                affected_subjects.append(previous.rows[0]["subject_id"])
+
         update_columns = ", ".join(f"{key} = ?" for key in data.keys())
         update_values = list(data.values())
         update_values += [grade_id, current_user["id"]]
-        sql = f"UPDATE grades SET {update_columns} WHERE id = ? and user_id=?"
-        db.execute(sql, update_values)
+        sql = f"UPDATE grades SET {update_columns} WHERE id = ? and user_id=? RETURNING subject_id"
+        result = db.execute(sql, update_values)
         if (
             data.get("grade") is not None
             or data.get("weight") is not None
             or subject_id is not None
         ):
-            update_subjects(current_user)
+            affected_subjects += [row["subject_id"] for row in result.rows]
+            update_subjects(current_user, affected_subjects)
+        else:
+            db.execute(*touch_user_statement(current_user["id"]))
+        response_cache.invalidate(current_user["id"])
         if response:
             if response["new_grade"]:
                 return (
@@ -608,6 +743,8 @@ def update_grade(current_user, grade_id):
             jsonify({"success": True, "message": "Grade updated successfully"}),
             200,
         )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -617,62 +754,318 @@ def update_grade(current_user, grade_id):
 @token_required
 def delete_grade(current_user, grade_id):
     try:
-        db.execute(
-            "DELETE FROM grades WHERE id=? AND user_id=?",
+        result = db.execute(
+            "DELETE FROM grades WHERE id=? AND user_id=? RETURNING subject_id",
             [grade_id, current_user["id"]],
         )
-        update_subjects(current_user)
+        update_subjects(
+            current_user, [row["subject_id"] for row in result.rows]
+        )
+        response_cache.invalidate(current_user["id"])
         return jsonify({"success": True, "message": "Grade deleted successfully"}), 200
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+def load_subjects(current_user):
+    result = db.execute(
+        "SELECT id, name, average, points, num_exams, weight FROM subjects WHERE user_id=?",
+        [current_user["id"]],
+    )
+    return encode_rows(result.columns, result.rows)
+
+
 # Route to get information about all subjects
 @api_routes.route("/subjects", methods=["GET"])
 @token_required
+@conditional_response
 def get_subjects(current_user):
     try:
-        result = db.execute(
-            "SELECT id, name, average, points, num_exams, weight FROM subjects WHERE user_id=?",
-            [current_user["id"]],
+        subjects_list = response_cache.get_or_load(
+            current_user["id"], "subjects", lambda: load_subjects(current_user)
         )
-        subjects_list = [
-            {
-                "id": subject["id"],
-                "name": subject["name"],
-                "average": subject["average"],
-                "points": subject["points"],
-                "num_exams": subject["num_exams"],
-                "weight": subject["weight"],
-            }
-            for subject in result.rows
-        ]
         return jsonify({"success": True, "subjects": subjects_list}), 200
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+def load_user(current_user):
+    result = db.execute(
+        "SELECT id, username, total_average, total_points, total_exams FROM users WHERE id=?",
+        [current_user["id"]],
+    )
+    user = result.rows[0]
+    return {
+        "id": user["id"],
+        "username": user["username"],
+        "total_average": user["total_average"],
+        "total_points": user["total_points"],
+        "total_exams": user["total_exams"],
+    }
+
+
 @api_routes.route("/user", methods=["GET"])
 @token_required
+@conditional_response
 def get_user(current_user):
     try:
-        result = db.execute(
-            "SELECT id, username, total_average, total_points, total_exams FROM users WHERE id=?",
-            [current_user["id"]],
+        user_list = response_cache.get_or_load(
+            current_user["id"], "user", lambda: load_user(current_user)
         )
-        user = result.rows[0]
-        user_list = {
-            "id": user["id"],
-            "username": user["username"],
-            "total_average": user["total_average"],
-            "total_points": user["total_points"],
-            "total_exams": user["total_exams"],
-        }
         return jsonify({"success": True, "user": user_list}), 200
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
+def load_stats(current_user, period, window):
+    subjects = db.execute(
+        "SELECT id, name, weight FROM subjects WHERE user_id=? ORDER BY id",
+        [current_user["id"]],
+    )
+    # Date order is served by the (user_id, date) index
+    grades = db.execute(
+        "SELECT id, subject_id, name, date, grade, weight FROM grades WHERE user_id=? ORDER BY date, id",
+        [current_user["id"]],
+    )
+    return compute_stats(
+        [{"id": row["id"], "name": row["name"], "weight": row["weight"]} for row in subjects.rows],
+        [
+            {
+                "id": row["id"],
+                "subject_id": row["subject_id"],
+                "name": row["name"],
+                "date": row["date"],
+                "grade": row["grade"],
+                "weight": row["weight"],
+            }
+            for row in grades.rows
+        ],
+        period,
+        window,
+    )
+
+
+# Route to get averages over time, rolling averages and grade distributions,
+# see grade_stats.py. Computed once per change of the user's data and cached.
+@api_routes.route("/stats", methods=["GET"])
+@token_required
+@conditional_response
+def get_stats(current_user):
+    try:
+        period = request.args.get("period") or "semester"
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        try:
+            window = int(request.args.get("window") or 5)
+        except ValueError:
+            raise ValueError("window must be a number")
+        if not 1 <= window <= 100:
+            raise ValueError("window must be between 1 and 100")
+
+        stats = response_cache.get_or_load(
+            current_user["id"],
+            f"stats:{period}:{window}",
+            lambda: load_stats(current_user, period, window),
+        )
+        return jsonify({"success": True, "stats": stats}), 200
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+# The whole gradebook in one query: the user row joined with every subject
+# and every grade of the subject, ordered so each subject's grades follow it
+OVERVIEW_SQL = """SELECT
+    u.id AS user_id, u.username, u.total_average, u.total_points, u.total_exams,
+    s.id AS subject_id, s.name AS subject_name, s.average, s.points, s.num_exams,
+    s.weight AS subject_weight,
+    g.id, g.name, g.grade, g.weight, g.date, g.details
+FROM users u
+LEFT JOIN subjects s ON s.user_id = u.id
+LEFT JOIN grades g ON g.subject_id = s.id AND g.user_id = u.id
+WHERE u.id=?
+ORDER BY s.id, g.id"""
+
+OVERVIEW_USER_FIELDS = ("id", "username", "total_average", "total_points", "total_exams")
+OVERVIEW_SUBJECT_FIELDS = ("id", "name", "average", "points", "num_exams", "weight")
+OVERVIEW_GRADE_FIELDS = ("id", "name", "grade", "weight", "date", "details")
+
+
+def load_overview(current_user):
+    result = db.execute(OVERVIEW_SQL, [current_user["id"]])
+    if not result.rows:
+        return None
+    user_end = len(OVERVIEW_USER_FIELDS)
+    subject_end = user_end + len(OVERVIEW_SUBJECT_FIELDS)
+    subjects = []
+    for row in result.rows:
+        values = row.astuple()
+        if values[user_end] is None:
+            continue
+        if not subjects or subjects[-1]["id"] != values[user_end]:
+            subject = dict(zip(OVERVIEW_SUBJECT_FIELDS, values[user_end:subject_end]))
+            subject["grades"] = []
+            subjects.append(subject)
+        if values[subject_end] is not None:
+            subjects[-1]["grades"].append(dict(zip(OVERVIEW_GRADE_FIELDS, values[subject_end:])))
+    user = dict(zip(OVERVIEW_USER_FIELDS, result.rows[0].astuple()[:user_end]))
+    return encode({"user": user, "subjects": subjects})
+
+
+# Route to get the user totals and all subjects with their grades in one
+# request, for clients loading the whole gradebook at start-up
+@api_routes.route("/overview", methods=["GET"])
+@token_required
+@conditional_response
+def get_overview(current_user):
+    try:
+        overview = response_cache.get_or_load(
+            current_user["id"], "overview", lambda: load_overview(current_user)
+        )
+        if overview is None:
+            return jsonify({"success": False, "message": "User not found"}), 404
+        return jsonify({"success": True, "overview": overview}), 200
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+# Function to load the user's subjects and grades into a Gradebook with a
+# single query, leaving out the grades in exclude
+def load_gradebook(current_user, exclude=()):
+    result = db.execute(
+        """SELECT s.id, s.name, s.weight AS subject_weight, g.id AS grade_id, g.grade, g.weight
+        FROM subjects s
+        LEFT JOIN grades g ON g.subject_id = s.id AND g.user_id = s.user_id
+        WHERE s.user_id=?
+        ORDER BY s.id, g.id""",
+        [current_user["id"]],
+    )
+    gradebook = Gradebook()
+    for row in result.rows:
+        if row["id"] not in gradebook.subjects:
+            gradebook.add_subject(SubjectRow(row["id"], row["name"], row["subject_weight"]))
+    gradebook.add_grades(
+        GradeRow(row["id"], row["grade"], row["weight"])
+        for row in result.rows
+        if row["grade_id"] is not None and row["grade_id"] not in exclude
+    )
+    return gradebook
+
+
+# Function to find the subject of a simulated grade or target by subject_id or
+# subject_name; unknown names become simulated subjects
+def simulated_subject(gradebook, data):
+    if data.get("subject_id") is not None:
+        if not is_id(data["subject_id"]) or data["subject_id"] not in gradebook.subjects:
+            raise ValueError(f"No subject found with id:{data['subject_id']}")
+        return data["subject_id"]
+    name = data.get("subject_name")
+    if not name:
+        raise ValueError("subject_id or subject_name is required")
+    if not isinstance(name, str):
+        raise ValueError("subject_name must be a string")
+    subject_id = gradebook.subject_id(name)
+    if subject_id is None:
+        subject_id = gradebook.add_new_subject(name, number_field(data, "subject_weight", 1))
+    return subject_id
+
+
+# Function to check that a value is an integer id (JSON booleans are not)
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Function to read the request body as a JSON object, an empty body counts
+# as an empty object
+def json_object():
+    if not request.get_data():
+        return {}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    return data
+
+
+# Function to read a number from the request body
+def number_field(data, key, default=None):
+    value = data.get(key, default)
+    if value is None or isinstance(value, bool):
+        raise ValueError(f"{key} must be a number")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be a number")
+
+
+# Route to simulate grades without saving them: returns the subject
+# aggregates and user totals with the hypothetical grades added (and stored
+# grades in "remove" left out), and with a "target" the lowest grade needed
+# on one more exam, see grade_math.py
+@api_routes.route("/simulate", methods=["POST"])
+@token_required
+def simulate(current_user):
+    try:
+        data = json_object()
+        remove = data.get("remove") or []
+        if not isinstance(remove, list) or not all(is_id(grade_id) for grade_id in remove):
+            raise ValueError("remove must be a list of grade ids")
+        grades = data.get("grades") or []
+        if not isinstance(grades, list) or not all(isinstance(grade, dict) for grade in grades):
+            raise ValueError("grades must be a list of objects")
+        target = data.get("target")
+        if target is not None and not isinstance(target, dict):
+            raise ValueError("target must be an object")
+
+        gradebook = load_gradebook(current_user, set(remove))
+        for grade in grades:
+            subject_id = simulated_subject(gradebook, grade)
+            gradebook.add_grades(
+                [GradeRow(subject_id, number_field(grade, "grade"), number_field(grade, "weight", 1))]
+            )
+
+        response = {
+            "success": True,
+            "subjects": [
+                gradebook.subject(subject_id).as_dict() for subject_id in gradebook.subjects
+            ],
+            "user": gradebook.totals(),
+        }
+
+        if target:
+            scope = target.get("scope", "total")
+            if scope not in ("total", "subject"):
+                raise ValueError("scope must be total or subject")
+            subject_id = simulated_subject(gradebook, target)
+            weight = number_field(target, "weight", 1)
+            average = number_field(target, "average")
+            step = number_field(target, "step", 0.01)
+            if not 0 < step <= 1:
+                raise ValueError("step must be between 0 and 1")
+            response["required_grade"] = {
+                "subject_id": subject_id if subject_id > 0 else None,
+                "subject_name": gradebook.subjects[subject_id].name,
+                "scope": scope,
+                "average": average,
+                "weight": weight,
+                "grade": gradebook.required_grade(
+                    subject_id, average, weight, scope, step
+                ),
+            }
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+# Response for requests rejected because the password hashing queue is full
+def busy_response(error):
+    response = jsonify({"success": False, "message": str(error)})
+    response.headers["Retry-After"] = "1"
+    return response, 429
+
+
 # what method should this be?
 @api_routes.route("/user/update_password", methods=["PUT"])
 @token_required
@@ -684,23 +1077,18 @@ def update_password(current_user):
         result = db.execute("SELECT password FROM users WHERE id = ?", [current_user["id"]])
         user = result.rows[0]
 
-        if user and check_password_hash(to_str(user["password"]), old_password):
-            hashed_password = generate_password_hash(
-                new_password, method="pbkdf2:sha256"
-            )
+        if user and password_hasher.verify(to_str(user["password"]), old_password):
+            hashed_password = password_hasher.hash(new_password)
             db.execute(
                 "UPDATE users SET password=? WHERE id=?",
                 [hashed_password, current_user["id"]],
             )
-            result = db.execute(
-                "SELECT username, password, id FROM users WHERE username = ?",
-                [current_user["username"]],
-            )
-            user = result.rows[0]
-            token = generate_jwt(current_user["username"], new_password)
-            return jsonify({"success": True, "token": token, "id": user["id"]}), 200
+            token = create_token(current_user["username"], current_user["id"])
+            return jsonify({"success": True, "token": token, "id": current_user["id"]}), 200
         else:
             return jsonify({"success": False, "message": "Invalid password"}), 401
+    except HashingBusy as e:
+        return busy_response(e)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -714,9 +1102,12 @@ def update_username(current_user):
         password = data.get("password")
 
         db.execute(
-            "UPDATE users SET username=? WHERE id=?",
+            f"UPDATE users SET username=?, last_modified={LAST_MODIFIED_NOW} WHERE id=?",
             [username, current_user["id"]],
         )
+        response_cache.invalidate(current_user["id"])
+        # Tokens with the old username must not stay admin through the cache
+        admin_cache.pop((current_user["username"], current_user["id"]))
 
         token = generate_jwt(username, password)
         return (
@@ -729,6 +1120,8 @@ def update_username(current_user):
             ),
             200,
         )
+    except HashingBusy as e:
+        return busy_response(e)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -768,13 +1161,13 @@ def register():
                 409,
             )
 
-        hashed_password = generate_password_hash(password, method="pbkdf2:sha256")
-        db.execute(
+        hashed_password = password_hasher.hash(password)
+        result = db.execute(
             "INSERT INTO users (username, password) VALUES (?, ?)",
             [username, hashed_password],
         )
 
-        token = generate_jwt(username, password)
+        token = create_token(username, result.last_insert_rowid)
         return (
             jsonify(
                 {
@@ -785,6 +1178,8 @@ def register():
             ),
             201,
         )
+    except HashingBusy as e:
+        return busy_response(e)
     except KeyError as e:
         # libsql-client can raise KeyError("result") on some failed writes
         return jsonify({"success": False, "message": f"Database error: {str(e)}"}), 500
@@ -803,6 +1198,8 @@ def login():
 
         return jsonify({"success": True, "token": token}), 200
 
+    except HashingBusy as e:
+        return busy_response(e)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -832,3 +1229,61 @@ def admin_delete_user(current_user, user_id):
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+
+@api_routes.route("/cache/stats", methods=["GET"])
+@admin_token_required
+def cache_stats(current_user):
+    return (
+        jsonify(
+            {
+                "success": True,
+                "cache": response_cache.stats(),
+                "tokens": token_cache.stats(),
+                "admins": admin_cache.stats(),
+            }
+        ),
+        200,
+    )
+
+
+# Request, database, cache and connection pool metrics for Prometheus
+@api_routes.route("/metrics", methods=["GET"])
+def get_metrics():
+    if METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        return jsonify({"success": False, "message": "Invalid metrics token"}), 401
+    body = request_metrics.render(
+        caches={
+            "response": response_cache.stats(),
+            "tokens": token_cache.stats(),
+            "admins": admin_cache.stats(),
+        },
+        pool=db.stats(),
+    )
+    return Response(body, content_type=CONTENT_TYPE)
+
+
+# Route to list the kept request profiles, newest first
+@api_routes.route("/profiles", methods=["GET"])
+@admin_token_required
+def list_profiles(current_user):
+    return jsonify({"success": True, "profiles": profiling.profile_store.summaries()}), 200
+
+
+# Route to get one request profile, or its raw stats for pstats/snakeviz
+# with ?format=pstats
+@api_routes.route("/profiles/<profile_id>", methods=["GET"])
+@admin_token_required
+def get_profile(current_user, profile_id):
+    entry = profiling.profile_store.get(profile_id)
+    if entry is None:
+        return jsonify({"success": False, "message": "Profile not found"}), 404
+    profile, data = entry
+    if request.args.get("format") == "pstats":
+        return Response(
+            data,
+            content_type="application/octet-stream",
+            headers={"Content-Disposition": f"attachment; filename={profile_id}.pstats"},
+        )
+    return jsonify({"success": True, "profile": profile}), 200
@@ -0,0 +1,182 @@
+"""In-process caches used by the API routes."""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from config import CACHE_MAX_ENTRIES, CACHE_TTL
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a time to live.
+
+    Counts hits and misses so the hit rate can be exposed.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store a value, ``ttl`` overrides the default time to live in seconds."""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class MemoryBackend:
+    """
+    Default per-user cache backend kept in process memory.
+
+    Every user has a generation number that is part of the cache key.
+    Invalidating a user moves them to a new generation, so all of their old
+    entries become unreachable and age out through the LRU. A value is only
+    stored if the user's generation is still the one it was loaded under,
+    so data read before a write is never cached after it.
+
+    Generations come from one counter. Users without an entry share the base
+    generation; when more than ``maxsize`` users have one, the cache starts
+    over with a new base instead of keeping a generation per user forever.
+
+    Other backends (e.g. one talking to Redis) only need to provide
+    ``generation``, ``get``, ``set``, ``invalidate`` and ``stats`` with the
+    same signatures.
+    """
+
+    def __init__(self, maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self._cache = TTLCache(maxsize, ttl)
+        self._generations = {}
+        self._base = 0
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def generation(self, user_id):
+        """Current generation of a user, to pass to ``get`` and ``set``."""
+        return self._generations.get(user_id, self._base)
+
+    def get(self, user_id, key, default=None, generation=None):
+        if generation is None:
+            generation = self.generation(user_id)
+        return self._cache.get((user_id, generation, key), default)
+
+    def set(self, user_id, key, value, generation=None):
+        """Store a value unless the user was invalidated since ``generation``."""
+        with self._lock:
+            current = self.generation(user_id)
+            if generation is not None and generation != current:
+                return
+            self._cache.set((user_id, current, key), value)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if len(self._generations) >= self._cache.maxsize:
+                self._generations.clear()
+                self._cache.clear()
+                self._base = next(self._counter)
+            self._generations[user_id] = next(self._counter)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class ResponseCache:
+    """
+    Read-through cache of response data keyed by user id.
+
+    Writes handled by this process invalidate the user directly. Writes of
+    other processes are noticed through ``check_version``: when the stored
+    version of a user's data is not the one their entries were loaded at,
+    the entries are dropped.
+    """
+
+    def __init__(self, backend=None, max_versions=CACHE_MAX_ENTRIES):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.max_versions = max_versions
+        # User id -> version of their data the cached entries belong to
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def check_version(self, user_id, version):
+        """
+        Drop the user's entries unless they were loaded at ``version``.
+
+        Called with the version just read from the database, before loading,
+        so the entries used afterwards are at least as new as that version.
+
+        :param user_id: Owner of the entries.
+        :param version: Version of the user's data, e.g. ``users.last_modified``.
+        """
+        with self._lock:
+            if user_id in self._versions and self._versions[user_id] == version:
+                return
+            if len(self._versions) >= self.max_versions:
+                self._versions.clear()
+            self._versions[user_id] = version
+        self.backend.invalidate(user_id)
+
+    def get_or_load(self, user_id, key, load):
+        """Return the cached value for ``key`` or call ``load()`` and cache it."""
+        # Taken before loading, so a write during load() keeps the result out
+        generation = self.backend.generation(user_id)
+        value = self.backend.get(user_id, key, _MISSING, generation)
+        if value is _MISSING:
+            value = load()
+            self.backend.set(user_id, key, value, generation)
+        return value
+
+    def invalidate(self, user_id):
+        """Drop everything cached for a user, called after each of their writes."""
+        self.backend.invalidate(user_id)
+
+    def stats(self):
+        return self.backend.stats()
+
+
+response_cache = ResponseCache()
+
+
+def configure_cache(backend):
+    """Swap the backend of the shared response cache."""
+    response_cache.backend = backend
@@ -0,0 +1,165 @@
+"""Pagination, date filters and field projection for grade listings.
+
+Query parameters understood by ``GradeQuery``:
+    limit   page size (1 to MAX_LIMIT), turns on pagination
+    cursor  ``next_cursor`` of the previous page
+    sort    ``id`` (default) or ``date``, prefixed with ``-`` for descending
+    from    first date to include, ``dd.mm.yyyy`` or ``yyyy-mm-dd``
+    to      last date to include
+    fields  comma separated subset of the grade fields, e.g. ``id,grade``
+
+Pages are cut with keyset conditions (``WHERE (date, id) > (?, ?)``)
+rather than OFFSET, so a page deep in the history costs the same as the
+first one and rows added meanwhile do not shift it.
+"""
+import base64
+import json
+from dates import normalize_date
+from .serialization import encode_rows
+
+MAX_LIMIT = 500
+
+# Output field -> SQL expression, on grades g (and subjects s for "subject")
+GRADE_FIELDS = {
+    "id": "g.id",
+    "name": "g.name",
+    "grade": "g.grade",
+    "weight": "g.weight",
+    "date": "g.date",
+    "details": "g.details",
+    "subject": "COALESCE(s.name, 'Unknown')",
+}
+
+SUBJECT_JOIN = "LEFT JOIN subjects s ON s.id = g.subject_id AND s.user_id = g.user_id"
+
+# Dates are stored in ISO form (see dates.py), so the (user_id, date) index
+# serves both the date ranges and the date order
+SORT_KEYS = {"id": "g.id", "date": "g.date"}
+
+# Types of the sort value in a cursor, dates may be NULL in old rows
+CURSOR_TYPES = {"id": int, "date": (str, type(None))}
+
+
+def encode_cursor(sort, key):
+    data = json.dumps([sort, key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(data)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("The cursor belongs to a different sort order")
+    # One value per keyset column: the sort column, then g.id
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError("Invalid cursor")
+    sort_types = CURSOR_TYPES[sort.lstrip("-")]
+    if not all(
+        isinstance(value, types) and not isinstance(value, bool)
+        for value, types in zip(key, (sort_types, int))
+    ):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+class GradeQuery:
+    """
+    Listing options parsed from the query string.
+
+    Without any parameter the query returns every grade ordered by id,
+    which is the response the routes had before pagination.
+    """
+
+    def __init__(self, args, fields=GRADE_FIELDS):
+        self.available = fields
+        self.limit = None
+        if args.get("limit"):
+            try:
+                self.limit = int(args["limit"])
+            except ValueError:
+                raise ValueError("limit must be a number")
+            if not 1 <= self.limit <= MAX_LIMIT:
+                raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+
+        self.sort = args.get("sort") or "id"
+        self.descending = self.sort.startswith("-")
+        self.sort_key = self.sort.lstrip("-")
+        if self.sort_key not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+
+        self.date_from = normalize_date(args["from"]) if args.get("from") else None
+        self.date_to = normalize_date(args["to"]) if args.get("to") else None
+
+        self.fields = list(fields)
+        if args.get("fields"):
+            self.fields = [field.strip() for field in args["fields"].split(",") if field.strip()]
+            unknown = [field for field in self.fields if field not in fields]
+            if unknown:
+                raise ValueError(
+                    f"Unknown field {unknown[0]!r}, available: {', '.join(fields)}"
+                )
+
+        self.cursor = decode_cursor(args["cursor"], self.sort) if args.get("cursor") else None
+        if self.cursor is not None and self.limit is None:
+            self.limit = MAX_LIMIT
+
+    @property
+    def cache_key(self):
+        """Part of the cache key that tells the listing options apart."""
+        return json.dumps(
+            [self.limit, self.sort, self.date_from, self.date_to, self.fields, self.cursor]
+        )
+
+    def sql(self, where, args):
+        """
+        Build the listing statement.
+
+        :param where: Conditions on grades ``g`` selecting the user's grades.
+        :param args: Parameters of ``where``.
+        :return: ``(sql, args)``; one row more than ``limit`` is fetched to
+            know whether there is a next page.
+        """
+        columns = [f"{self.available[field]} AS {field}" for field in self.fields]
+        # The cursor needs the id and the sort value of the last row
+        columns += ["g.id AS _id", f"{SORT_KEYS[self.sort_key]} AS _sort"]
+        sql = f"SELECT {', '.join(columns)} FROM grades g"
+        if "subject" in self.fields:
+            sql += " " + SUBJECT_JOIN
+
+        conditions = [where]
+        args = list(args)
+        if self.date_from:
+            conditions.append("g.date >= ?")
+            args.append(self.date_from)
+        if self.date_to:
+            conditions.append("g.date <= ?")
+            args.append(self.date_to)
+        comparison, direction = ("<", "DESC") if self.descending else (">", "ASC")
+        if self.cursor is not None:
+            conditions.append(f"({SORT_KEYS[self.sort_key]}, g.id) {comparison} (?, ?)")
+            args += self.cursor
+
+        sql += f" WHERE {' AND '.join(conditions)}"
+        sql += f" ORDER BY {SORT_KEYS[self.sort_key]} {direction}, g.id {direction}"
+        if self.limit is not None:
+            sql += " LIMIT ?"
+            args.append(self.limit + 1)
+        return sql, args
+
+    def page(self, rows):
+        """
+        Turn the fetched rows into the response items.
+
+        :return: ``(items, next_cursor)``, the cursor is ``None`` on the last
+            page; ``items`` as returned by ``encode_rows``.
+        """
+        next_cursor = None
+        if self.limit is not None and len(rows) > self.limit:
+            rows = rows[: self.limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(self.sort, [last["_sort"], last["_id"]])
+        # The selected fields are the first columns, see sql()
+        return encode_rows(self.fields, rows), next_cursor
@@ -0,0 +1,296 @@
+"""Request and database metrics in the Prometheus text format.
+
+``init_app`` times every request of the app and wraps the shared ``db``
+client, so each ``execute()`` and ``batch()`` is counted and timed. The
+statements a request ran and the time it spent waiting on the database are
+collected in a context variable and recorded with its route at the end:
+
+    http_requests_total{method, route, status}
+    http_request_duration_seconds{method, route}        histogram
+    http_request_db_statements{method, route}           histogram
+    http_request_db_duration_seconds{method, route}     histogram
+    db_round_trips_total{kind}                          execute or batch
+    db_statements_total, db_duration_seconds_total
+
+``GET /metrics`` renders them with the cache and connection pool
+statistics. Routes are labelled with their rule (``/grades/<int:grade_id>``)
+rather than the path, so the number of series stays bounded.
+
+Requests slower than ``slow_request_ms`` and database calls slower than
+``slow_query_ms`` are logged as warnings; 0 turns either log off.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Database work of the request being handled on this thread
+_request_stats = ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum."""
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One more bucket for everything above the last bound (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        """Sample lines with cumulative buckets, ``_sum`` and ``_count``."""
+        cumulative = 0
+        for bound, count in zip((*self.bounds, "+Inf"), self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels(labels, le=bound)} {cumulative}"
+        yield f"{name}_sum{_labels(labels)} {_number(self.sum)}"
+        yield f"{name}_count{_labels(labels)} {cumulative}"
+
+
+class RequestStats:
+    """Statements, round trips and seconds a request spent on the database."""
+
+    __slots__ = ("statements", "round_trips", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.round_trips = 0
+        self.seconds = 0.0
+
+
+class _RouteHistograms:
+    __slots__ = ("duration", "statements", "db_duration")
+
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_duration = Histogram(DURATION_BUCKETS)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    pairs = [*labels.items(), *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _one_line(sql, limit=200):
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= limit else sql[:limit] + "..."
+
+
+class Metrics:
+    """Thread-safe registry of the request and database metrics."""
+
+    def __init__(self, slow_request_ms=0, slow_query_ms=0):
+        self.slow_request_ms = slow_request_ms
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        # (method, route, status) -> requests
+        self._requests = {}
+        # (method, route) -> _RouteHistograms
+        self._routes = {}
+        self._round_trips = {"execute": 0, "batch": 0}
+        self._statements = 0
+        self._db_seconds = 0.0
+
+    def observe_request(self, method, route, status, seconds, stats):
+        with self._lock:
+            key = (method, route, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histograms = self._routes.get((method, route))
+            if histograms is None:
+                histograms = self._routes[(method, route)] = _RouteHistograms()
+            histograms.duration.observe(seconds)
+            histograms.statements.observe(stats.statements)
+            histograms.db_duration.observe(stats.seconds)
+
+    def observe_query(self, kind, statements, seconds, sql):
+        """Record one ``execute`` or ``batch`` call, also for the current request."""
+        with self._lock:
+            self._round_trips[kind] += 1
+            self._statements += statements
+            self._db_seconds += seconds
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.statements += statements
+            stats.round_trips += 1
+            stats.seconds += seconds
+        if self.slow_query_ms and seconds * 1000 >= self.slow_query_ms:
+            logger.warning("Slow %s (%.1f ms, %d statements): %s", kind, seconds * 1000, statements, _one_line(sql))
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._routes.clear()
+            self._round_trips = dict.fromkeys(self._round_trips, 0)
+            self._statements = 0
+            self._db_seconds = 0.0
+
+    def render(self, caches=None, pool=None):
+        """
+        The metrics in the Prometheus text exposition format.
+
+        :param caches: Cache name -> ``stats()`` dict of a cache, exposed as
+            ``cache_entries``, ``cache_hits_total`` and ``cache_misses_total``.
+        :param pool: ``db.stats()``, each number exposed as ``db_pool_<key>``.
+        :return: The exposition as a string.
+        """
+        with self._lock:
+            requests = sorted(self._requests.items())
+            routes = sorted(self._routes.items())
+            lines = [
+                "# HELP http_requests_total Requests by route and status code.",
+                "# TYPE http_requests_total counter",
+                *(
+                    f"http_requests_total{_labels({'method': method, 'route': route, 'status': status})} {count}"
+                    for (method, route, status), count in requests
+                ),
+            ]
+            for name, attribute, help_text in (
+                ("http_request_duration_seconds", "duration", "Time to handle a request."),
+                ("http_request_db_statements", "statements", "Database statements run by a request."),
+                ("http_request_db_duration_seconds", "db_duration", "Time a request waited on the database."),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (method, route), histograms in routes:
+                    lines += getattr(histograms, attribute).lines(name, {"method": method, "route": route})
+            lines += [
+                "# HELP db_round_trips_total Database calls by kind.",
+                "# TYPE db_round_trips_total counter",
+                *(f'db_round_trips_total{{kind="{kind}"}} {count}' for kind, count in self._round_trips.items()),
+                "# HELP db_statements_total Statements sent to the database.",
+                "# TYPE db_statements_total counter",
+                f"db_statements_total {self._statements}",
+                "# HELP db_duration_seconds_total Time spent waiting on the database.",
+                "# TYPE db_duration_seconds_total counter",
+                f"db_duration_seconds_total {_number(self._db_seconds)}",
+            ]
+
+        for name, key, kind, help_text in (
+            ("cache_entries", "entries", "gauge", "Entries in a cache."),
+            ("cache_hits_total", "hits", "counter", "Cache lookups that found an entry."),
+            ("cache_misses_total", "misses", "counter", "Cache lookups that found nothing."),
+        ):
+            samples = [
+                f'{name}{{cache="{_escape(cache)}"}} {_number(stats[key])}'
+                for cache, stats in (caches or {}).items()
+                if isinstance(stats.get(key), (int, float))
+            ]
+            if samples:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+
+        for key, value in (pool or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines += [f"# TYPE db_pool_{key} gauge", f"db_pool_{key} {_number(value)}"]
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = Metrics()
+
+
+class InstrumentedClient:
+    """Database client wrapper that reports every call to ``metrics``."""
+
+    def __init__(self, client, metrics=request_metrics):
+        self._client = client
+        self._metrics = metrics
+
+    def execute(self, sql, args=None):
+        start = time.perf_counter()
+        try:
+            return self._client.execute(sql, args)
+        finally:
+            self._metrics.observe_query("execute", 1, time.perf_counter() - start, sql)
+
+    def batch(self, statements):
+        start = time.perf_counter()
+        try:
+            return self._client.batch(statements)
+        finally:
+            first = statements[0][0] if statements else ""
+            self._metrics.observe_query("batch", len(statements), time.perf_counter() - start, first)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def current_request_stats():
+    """Database work of the current request so far (empty outside of requests)."""
+    stats = _request_stats.get()
+    return stats if stats is not None else RequestStats()
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_token = _request_stats.set(RequestStats())
+
+
+def _after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return response
+    seconds = time.perf_counter() - start
+    stats = current_request_stats()
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    request_metrics.observe_request(request.method, route, response.status_code, seconds, stats)
+    if request_metrics.slow_request_ms and seconds * 1000 >= request_metrics.slow_request_ms:
+        logger.warning(
+            "Slow request %s %s -> %d (%.1f ms, %d statements in %d round trips, %.1f ms in the database)",
+            request.method,
+            request.path,
+            response.status_code,
+            seconds * 1000,
+            stats.statements,
+            stats.round_trips,
+            stats.seconds * 1000,
+        )
+    return response
+
+
+def _teardown_request(error=None):
+    token = g.pop("metrics_token", None)
+    if token is not None:
+        _request_stats.reset(token)
+
+
+def init_app(app, db, slow_request_ms=0, slow_query_ms=0):
+    """
+    Record the metrics of every request of ``app`` and every call of ``db``.
+
+    :param app: Flask app.
+    :param db: Shared ``LazyClient``, wrapped with ``InstrumentedClient``.
+    :param slow_request_ms: Log requests taking at least this long, 0 for never.
+    :param slow_query_ms: Log database calls taking at least this long, 0 for never.
+    """
+    request_metrics.slow_request_ms = slow_request_ms
+    request_metrics.slow_query_ms = slow_query_ms
+    db.wrap(InstrumentedClient)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,203 @@
+"""Grade and subject operations of ``POST /batch``.
+
+Each operation is an object with an ``op`` and the fields of the matching
+single route:
+
+    add_grade       subject_id or subject_name, date, name, grade, weight, details
+    update_grade    id, and any of date, name, grade, weight, details,
+                    subject_id, subject_name
+    delete_grade    id
+    add_subject     name, weight
+    update_subject  id, and name and/or weight
+    delete_subject  id
+
+All operations become statements of one ``db.batch()``, so they run in a
+single transaction and round trip, followed by one refresh of the
+aggregates. Subjects given by name are created when missing (like
+``POST /grades``) and looked up by subqueries, so later operations can use
+subjects created by earlier ones. Updates and deletes of ids the user does
+not own change nothing and are reported as not found.
+"""
+from aggregates import aggregate_statements
+from dates import normalize_date
+
+MAX_OPERATIONS = 100
+
+GRADE_COLUMNS = ("date", "name", "grade", "weight", "details")
+
+# Fields each operation accepts besides "op"
+OPERATION_FIELDS = {
+    "add_grade": {"subject_id", "subject_name", *GRADE_COLUMNS},
+    "update_grade": {"id", "subject_id", "subject_name", *GRADE_COLUMNS},
+    "delete_grade": {"id"},
+    "add_subject": {"name", "weight"},
+    "update_subject": {"id", "name", "weight"},
+    "delete_subject": {"id"},
+}
+
+# The subject of a grade, given by id or name, if it belongs to the user
+SUBJECT_BY_ID = "SELECT id FROM subjects WHERE id=? AND user_id=?"
+SUBJECT_BY_NAME = "SELECT id FROM subjects WHERE name=? AND user_id=? ORDER BY id LIMIT 1"
+
+# Creates a subject unless the user has one of that name, also on databases
+# without the unique index of migration 3
+CREATE_SUBJECT_BY_NAME = """INSERT INTO subjects (name, user_id)
+SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM subjects WHERE name=? AND user_id=?)"""
+
+
+class BatchOperations:
+    """
+    Operations parsed from the request body and the statements running them.
+
+    Raises ``ValueError`` naming the index of the first invalid operation.
+    """
+
+    def __init__(self, user_id, operations):
+        if not isinstance(operations, list) or not operations:
+            raise ValueError("operations must be a non-empty list")
+        if len(operations) > MAX_OPERATIONS:
+            raise ValueError(f"At most {MAX_OPERATIONS} operations per batch")
+        self.user_id = user_id
+        self.operations = operations
+        self.statements = []
+        # Index of the statement whose rows are the result of each operation
+        self._result_statements = []
+        for index, operation in enumerate(operations):
+            try:
+                self._add(operation)
+            except ValueError as e:
+                raise ValueError(f"Operation {index}: {e}")
+        self.statements += aggregate_statements(user_id)
+
+    def _statement(self, sql, args):
+        self.statements.append((sql, args))
+        return len(self.statements) - 1
+
+    def _subject(self, data):
+        """Subquery and arguments selecting the subject of a grade operation."""
+        if data.get("subject_id") is not None:
+            return SUBJECT_BY_ID, [data["subject_id"], self.user_id]
+        name = data.get("subject_name")
+        if not name:
+            raise ValueError("subject_id or subject_name is required")
+        self._statement(CREATE_SUBJECT_BY_NAME, [name, self.user_id, name, self.user_id])
+        return SUBJECT_BY_NAME, [name, self.user_id]
+
+    def _id(self, data):
+        if not isinstance(data.get("id"), int) or isinstance(data.get("id"), bool):
+            raise ValueError("id must be an integer")
+        return data["id"]
+
+    def _add(self, operation):
+        if not isinstance(operation, dict):
+            raise ValueError("Expected an object")
+        op = operation.get("op")
+        if op not in OPERATION_FIELDS:
+            raise ValueError(f"op must be one of {', '.join(OPERATION_FIELDS)}")
+        data = {key: value for key, value in operation.items() if key != "op"}
+        unknown = sorted(set(data) - OPERATION_FIELDS[op])
+        if unknown:
+            raise ValueError(f"Invalid key: {unknown[0]}")
+        if "date" in data:
+            data["date"] = normalize_date(data["date"])
+
+        if op == "add_grade":
+            for column in ("date", "name"):
+                if not data.get(column):
+                    raise ValueError(f"{column} is required")
+            subject_sql, subject_args = self._subject(data)
+            # Columns left out get their defaults, e.g. a weight of 1
+            columns = [column for column in GRADE_COLUMNS if column in data]
+            placeholders = ", ".join("?" for _ in columns)
+            self._result_statements.append(
+                self._statement(
+                    f"""INSERT INTO grades ({', '.join(columns)}, subject_id, user_id)
+                    SELECT {placeholders}, s.id, ? FROM ({subject_sql}) s
+                    RETURNING id, subject_id""",
+                    [*(data[column] for column in columns), self.user_id, *subject_args],
+                )
+            )
+        elif op == "update_grade":
+            grade_id = self._id(data)
+            columns = [column for column in GRADE_COLUMNS if column in data]
+            assignments = [f"{column} = ?" for column in columns]
+            args = [data[column] for column in columns]
+            # Placeholders in order: SET values, the subject subquery, WHERE
+            from_clause, subject_args = "", []
+            if data.get("subject_id") is not None or data.get("subject_name") is not None:
+                subject_sql, subject_args = self._subject(data)
+                assignments.append("subject_id = s.id")
+                from_clause = f"FROM ({subject_sql}) s"
+            if not assignments:
+                raise ValueError("Nothing to update")
+            self._result_statements.append(
+                self._statement(
+                    f"""UPDATE grades SET {', '.join(assignments)} {from_clause}
+                    WHERE grades.id=? AND grades.user_id=? RETURNING grades.id""",
+                    [*args, *subject_args, grade_id, self.user_id],
+                )
+            )
+        elif op == "delete_grade":
+            self._result_statements.append(
+                self._statement(
+                    "DELETE FROM grades WHERE id=? AND user_id=? RETURNING id",
+                    [self._id(data), self.user_id],
+                )
+            )
+        elif op == "add_subject":
+            if not data.get("name"):
+                raise ValueError("name is required")
+            self._result_statements.append(
+                self._statement(
+                    "INSERT INTO subjects (name, weight, user_id) VALUES (?, ?, ?) RETURNING id",
+                    [data["name"], data.get("weight", 1), self.user_id],
+                )
+            )
+        elif op == "update_subject":
+            subject_id = self._id(data)
+            columns = [column for column in ("name", "weight") if data.get(column) is not None]
+            if not columns:
+                raise ValueError("Nothing to update")
+            self._result_statements.append(
+                self._statement(
+                    f"UPDATE subjects SET {', '.join(f'{column} = ?' for column in columns)} "
+                    "WHERE id=? AND user_id=? RETURNING id",
+                    [*(data[column] for column in columns), subject_id, self.user_id],
+                )
+            )
+        else:
+            self._result_statements.append(
+                self._statement(
+                    "DELETE FROM subjects WHERE id=? AND user_id=? RETURNING id",
+                    [self._id(data), self.user_id],
+                )
+            )
+
+    def results(self, result_sets):
+        """
+        Result of every operation from the results of ``statements``.
+
+        :return: List of dicts with ``op`` and ``success``; the ``id`` of
+            added rows (and the ``subject_id`` of added grades), or a
+            ``message`` when nothing was found.
+        """
+        results = []
+        for operation, index in zip(self.operations, self._result_statements):
+            op = operation["op"]
+            rows = result_sets[index].rows
+            if not rows:
+                if op == "add_grade":
+                    message = "Subject not found"
+                elif op == "update_grade":
+                    message = "Grade or subject not found"
+                else:
+                    message = f"{'Subject' if op.endswith('subject') else 'Grade'} not found"
+                results.append({"op": op, "success": False, "message": message})
+                continue
+            result = {"op": op, "success": True}
+            if op.startswith("add"):
+                result["id"] = rows[0]["id"]
+            if op == "add_grade":
+                result["subject_id"] = rows[0]["subject_id"]
+            results.append(result)
+        return results
@@ -0,0 +1,111 @@
+"""Password hashing off the request thread.
+
+pbkdf2 is deliberately slow and holds the GIL, so hashing on the request
+worker stalls every other request of that process. The hashes are computed
+in a small process pool instead, with a cap on the number of hashes in
+flight so a login storm gets ``429`` responses instead of an ever growing
+queue.
+"""
+import logging
+import threading
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+from config import HASH_QUEUE_LIMIT, HASH_WORKERS, PASSWORD_HASH_METHOD
+
+logger = logging.getLogger(__name__)
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+def method_prefix(method):
+    """
+    Prefix of the hashes ``generate_password_hash`` makes with ``method``,
+    e.g. ``"pbkdf2:sha256:1000000"``, with werkzeug's defaults filled in.
+
+    :param method: Werkzeug hash method such as ``"pbkdf2:sha256"`` or ``"scrypt"``.
+    :return: The prefix, without computing a hash.
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        n, r, p = args or (2**15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+class PasswordHasher:
+    """
+    Bounded hashing service backed by a process pool.
+
+    With ``workers=0`` (or where processes cannot be started, e.g. some
+    serverless runtimes) the hashes run inline, still bounded by the queue
+    limit.
+    """
+
+    def __init__(self, workers, queue_limit, method):
+        self.workers = workers
+        self.method = method
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._method_prefix = method_prefix(method)
+
+    def _get_executor(self):
+        if self.workers <= 0:
+            return None
+        with self._executor_lock:
+            if self._executor is None:
+                # Imported on first use, they are slow to import on a cold start
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                try:
+                    # Plain fork is not safe while the database client thread runs
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                    )
+                except (OSError, NotImplementedError):
+                    logger.warning("Hashing in process, no process pool", exc_info=True)
+                    self.workers = 0
+            return self._executor
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy("Too many login requests, please try again")
+        try:
+            executor = self._get_executor()
+            if executor is not None:
+                from concurrent.futures.process import BrokenProcessPool
+
+                try:
+                    return executor.submit(func, *args).result()
+                except BrokenProcessPool:
+                    logger.warning("Hashing in process, process pool failed", exc_info=True)
+                    with self._executor_lock:
+                        self.workers = 0
+            return func(*args)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Hash a password with the configured method."""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash."""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Whether a stored hash was made with a different method or cost than
+        the configured one and should be replaced on the next login.
+        """
+        return password_hash.split("$")[0] != self._method_prefix
+
+
+password_hasher = PasswordHasher(HASH_WORKERS, HASH_QUEUE_LIMIT, PASSWORD_HASH_METHOD)
@@ -0,0 +1,205 @@
+"""Profiles of single requests, opted into by admins.
+
+A request with the ``X-Profile`` header and an admin token runs under
+cProfile. The response carries the id of the profile in ``X-Profile-Id``
+and a ``Server-Timing`` header with the time spent in
+
+    jwt            verifying the token (PyJWT and the token cache)
+    db             waiting on the database, from the request's metrics
+    aggregation    grade_math, grade_stats and aggregates
+    serialization  JSON encoding and decoding
+    other          everything else
+
+The most recent profiles are kept in memory with their slowest functions
+and the raw stats, which ``pstats``, snakeviz and similar tools can load.
+Requests without the header only pay for the header lookup.
+
+Since Python 3.12 there is one profiler per process, so one request is
+profiled at a time, and functions of other requests handled by the process
+during the profile show up in its function list (not in the db time).
+"""
+import cProfile
+import datetime
+import marshal
+import os
+import pstats
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+from config import PROFILE_HISTORY
+from .metrics import current_request_stats
+
+PROFILE_HEADER = "X-Profile"
+
+# Functions listed per profile, by cumulative time
+TOP_FUNCTIONS = 30
+
+_AGGREGATION_MODULES = ("grade_math.py", "grade_stats.py", "aggregates.py")
+_JSON_DIRECTORY = f"{os.sep}json{os.sep}"
+
+
+def _category(function):
+    """Category of a pstats function key, or None."""
+    filename, _, name = function
+    basename = os.path.basename(filename)
+    if f"{os.sep}jwt{os.sep}" in filename or (
+        basename == "api.py" and name in ("decode_token", "create_token")
+    ):
+        return "jwt"
+    if basename in _AGGREGATION_MODULES:
+        return "aggregation"
+    if _JSON_DIRECTORY in filename or filename.endswith(os.path.join("APIendpoints", "serialization.py")):
+        return "serialization"
+    # Database clients, only so that their JSON handling is not counted as serialization
+    if basename in ("storage.py", "turso_client.py", "metrics.py") or "libsql" in filename or "aiohttp" in filename:
+        return "db"
+    return None
+
+
+def breakdown(stats):
+    """
+    Seconds spent in each category of a profile.
+
+    Counts the calls into a category from functions outside of every
+    category, so nested calls (e.g. JSON decoding within PyJWT) are counted
+    once, in the outer category.
+
+    :param stats: ``pstats.Stats`` of the profile.
+    :return: Dict category -> seconds.
+    """
+    seconds = {"jwt": 0.0, "aggregation": 0.0, "serialization": 0.0, "db": 0.0}
+    categories = {function: _category(function) for function in stats.stats}
+    for function, (_, _, _, cumulative, callers) in stats.stats.items():
+        category = categories[function]
+        if category is None:
+            continue
+        if not callers:
+            seconds[category] += cumulative
+            continue
+        for caller, edge in callers.items():
+            if categories.get(caller, _category(caller)) is None:
+                seconds[category] += edge[3]
+    return seconds
+
+
+def _short(filename):
+    """Path of a profiled file from its package or the repository on."""
+    for marker in ("site-packages" + os.sep, os.getcwd() + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    return filename
+
+
+class ProfileStore:
+    """Thread-safe store of the most recent profiles."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile, data):
+        """Keep ``profile`` (a dict with an ``id``) and its marshalled stats."""
+        with self._lock:
+            self._profiles[profile["id"]] = (profile, data)
+            while len(self._profiles) > self.maxsize:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id):
+        """``(profile, marshalled stats)`` or None."""
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def summaries(self):
+        """The profiles without their function lists, newest first."""
+        with self._lock:
+            profiles = [profile for profile, _ in reversed(self._profiles.values())]
+        return [{key: value for key, value in profile.items() if key != "functions"} for profile in profiles]
+
+
+profile_store = ProfileStore(maxsize=PROFILE_HISTORY)
+
+# Held while a request is profiled
+_profiling = threading.Lock()
+
+
+def start():
+    """
+    Profile the current request until ``finish`` (or ``abort``).
+
+    :return: None, or an error response when another request is profiled.
+    """
+    if not _profiling.acquire(blocking=False):
+        return jsonify({"success": False, "message": "Another request is being profiled"}), 409
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Some other profiler (e.g. a debugger) is active
+        _profiling.release()
+        return jsonify({"success": False, "message": "Another profiler is active"}), 409
+    stats = current_request_stats()
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    g.profile = (profiler, started, time.perf_counter(), stats.seconds, stats.statements, stats.round_trips)
+    return None
+
+
+def abort():
+    """Stop profiling without keeping the profile, e.g. after an error."""
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile[0].disable()
+        _profiling.release()
+
+
+def finish(response):
+    """Stop profiling, keep the profile and add its headers to ``response``."""
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    profiler, started, start_time, db_seconds, db_statements, db_round_trips = profile
+    total = time.perf_counter() - start_time
+    try:
+        profiler.disable()
+    finally:
+        _profiling.release()
+
+    stats = pstats.Stats(profiler)
+    seconds = breakdown(stats)
+    request_stats = current_request_stats()
+    # Wall clock time waiting on the database, also on other threads
+    seconds["db"] = request_stats.seconds - db_seconds
+    seconds["other"] = max(total - sum(seconds.values()), 0.0)
+
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    record = {
+        "id": uuid.uuid4().hex[:16],
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "status": response.status_code,
+        "started": started,
+        "total_ms": round(total * 1000, 3),
+        "breakdown_ms": {category: round(value * 1000, 3) for category, value in seconds.items()},
+        "db_statements": request_stats.statements - db_statements,
+        "db_round_trips": request_stats.round_trips - db_round_trips,
+        "functions": [
+            {
+                "function": f"{_short(filename)}:{line}({name})",
+                "calls": calls,
+                "own_ms": round(own * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3),
+            }
+            for (filename, line, name), (_, calls, own, cumulative, _) in functions[:TOP_FUNCTIONS]
+        ],
+    }
+    profile_store.add(record, marshal.dumps(stats.stats))
+
+    response.headers["X-Profile-Id"] = record["id"]
+    response.headers["Server-Timing"] = ", ".join(
+        f"{category};dur={value}" for category, value in (*record["breakdown_ms"].items(), ("total", record["total_ms"]))
+    )
+    return response
@@ -0,0 +1,98 @@
+"""JSON encoding of API responses.
+
+With ``orjson`` installed (the ``fast-json`` extra) the app serializes its
+responses with it instead of the standard library. The output keeps the
+sorted keys of Flask's default provider and its handling of dates, it is
+only UTF-8 instead of ASCII with escapes.
+
+Listings encode their rows with ``encode_rows``: each row becomes a dict
+straight from its value tuple, and with orjson the whole list is encoded
+once into a ``Fragment`` that the response cache keeps. A cached listing is
+then embedded into the response as is instead of being serialized again.
+"""
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON_PROVIDER values: orjson when installed, or always one of them
+PROVIDERS = ("auto", "orjson", "default")
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, with the default provider's key order."""
+
+    # Dates and dataclasses go through Flask's default() like before
+    options = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        if orjson
+        else 0
+    )
+
+    @staticmethod
+    def default(o):
+        # Cached fragments in responses that take the standard library path
+        if isinstance(o, orjson.Fragment):
+            return orjson.loads(orjson.dumps(o))
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # indent, separators and the like, only used in debug mode
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_app(app, provider="auto"):
+    """
+    Register the JSON provider on the app.
+
+    :param provider: One of ``PROVIDERS``.
+    """
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown JSON_PROVIDER {provider!r}, expected one of {', '.join(PROVIDERS)}")
+    if provider == "orjson" and orjson is None:
+        raise RuntimeError("JSON_PROVIDER=orjson needs the orjson package")
+    if provider != "default" and orjson is not None:
+        app.json = ORJSONProvider(app)
+
+
+def encode(obj):
+    """
+    Encode a response part once, for values kept in the response cache.
+
+    :return: With the orjson provider an ``orjson.Fragment`` holding the
+        encoded object, otherwise the object itself.
+    """
+    if isinstance(current_app.json, ORJSONProvider):
+        return orjson.Fragment(orjson.dumps(obj, default=ORJSONProvider.default, option=ORJSONProvider.options))
+    return obj
+
+
+def encode_rows(fields, rows):
+    """
+    Encode result rows as a list of objects.
+
+    :param fields: Names of the first columns of the rows, in order.
+    :param rows: libsql ``Row`` objects, further columns are left out.
+    :return: The list of dicts, passed through ``encode``.
+    """
+    return encode([dict(zip(fields, row.astuple())) for row in rows])
@@ -0,0 +1,113 @@
+"""Set-based SQL for the subject and user aggregates.
+
+A subject's average is the weighted mean of its non-zero grades, rounded to
+three decimals. Points are ``(average - 4) * 2`` above 4 and 0 otherwise.
+Subjects without grades have NULL average, points and num_exams. The user
+totals are the subject averages and points weighted by the subject weight,
+over all subjects that have grades.
+
+Refreshing the user totals also stamps ``users.last_modified``, which drives
+the ETag header of the GET routes.
+"""
+
+# Millisecond timestamp, so two writes within one second still differ
+LAST_MODIFIED_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Grades of 0 (or empty) are placeholders and do not count towards the average
+_COUNTED_GRADE = "CAST(g.grade AS REAL) != 0"
+
+SUBJECT_AGGREGATES_SQL = f"""
+UPDATE subjects SET
+    average = agg.average,
+    points = agg.points,
+    num_exams = agg.num_exams
+FROM (
+    SELECT
+        subject_id,
+        CASE WHEN num_exams = 0 THEN NULL ELSE average END AS average,
+        CASE
+            WHEN num_exams = 0 THEN NULL
+            WHEN average > 4 THEN ROUND((average - 4) * 2, 3)
+            ELSE 0
+        END AS points,
+        NULLIF(num_exams, 0) AS num_exams
+    FROM (
+        SELECT
+            s.id AS subject_id,
+            ROUND(COALESCE(
+                SUM(CASE WHEN {_COUNTED_GRADE} THEN g.grade * g.weight END)
+                / NULLIF(SUM(CASE WHEN {_COUNTED_GRADE} THEN g.weight END), 0),
+                0
+            ), 3) AS average,
+            COUNT(g.id) AS num_exams
+        FROM subjects s
+        LEFT JOIN grades g ON g.subject_id = s.id AND g.user_id = s.user_id
+        WHERE s.user_id = ? {{subject_filter}}
+        GROUP BY s.id
+    )
+) AS agg
+WHERE subjects.id = agg.subject_id
+"""
+
+USER_TOTALS_SQL = f"""
+UPDATE users SET
+    total_average = agg.total_average,
+    total_points = agg.total_points,
+    total_exams = agg.total_exams,
+    last_modified = {LAST_MODIFIED_NOW}
+FROM (
+    SELECT
+        ROUND(COALESCE(SUM(average * weight) / NULLIF(SUM(weight), 0), 0), 3) AS total_average,
+        COALESCE(SUM(points * weight), 0.0) AS total_points,
+        COALESCE(SUM(num_exams), 0) AS total_exams
+    FROM subjects
+    WHERE user_id = ? AND num_exams IS NOT NULL AND num_exams != ''
+) AS agg
+WHERE users.id = ?
+"""
+
+
+def subject_aggregates_statement(user_id, subject_ids=None):
+    """
+    Statement recomputing average, points and num_exams of a user's subjects.
+
+    :param user_id: Owner of the subjects.
+    :param subject_ids: Only recompute these subjects, or all when None.
+    :return: ``(sql, args)`` tuple for ``db.execute``/``db.batch``.
+    """
+    if subject_ids is None:
+        return SUBJECT_AGGREGATES_SQL.format(subject_filter=""), [user_id]
+    subject_ids = list(subject_ids)
+    placeholders = ", ".join("?" for _ in subject_ids)
+    return (
+        SUBJECT_AGGREGATES_SQL.format(subject_filter=f"AND s.id IN ({placeholders})"),
+        [user_id, *subject_ids],
+    )
+
+
+def user_totals_statement(user_id):
+    """
+    Statement recomputing total_average, total_points and total_exams of a user.
+
+    :param user_id: The user to update.
+    :return: ``(sql, args)`` tuple for ``db.execute``/``db.batch``.
+    """
+    return USER_TOTALS_SQL, [user_id, user_id]
+
+
+def touch_user_statement(user_id):
+    """Statement stamping ``users.last_modified`` for writes that leave the totals alone."""
+    return f"UPDATE users SET last_modified = {LAST_MODIFIED_NOW} WHERE id=?", [user_id]
+
+
+def aggregate_statements(user_id, subject_ids=None):
+    """
+    Statements refreshing the given subjects (all when None) and the user totals.
+
+    :return: List of ``(sql, args)`` tuples, meant to run in one batch.
+    """
+    statements = []
+    if subject_ids is None or subject_ids:
+        statements.append(subject_aggregates_statement(user_id, subject_ids))
+    statements.append(user_totals_statement(user_id))
+    return statements
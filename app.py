@@ -5,8 +5,16 @@ from datetime import datetime
 from flask_sitemapper import Sitemapper
 from keygen import generate_api_key
 from APIendpoints.api import api_routes
+from APIendpoints import metrics, serialization
+from config import AUTO_MIGRATE, JSON_PROVIDER, SLOW_QUERY_MS, SLOW_REQUEST_MS, db
+from migrations import migrate
 
 app = Flask(__name__)
+serialization.init_app(app, JSON_PROVIDER)
+metrics.init_app(app, db, SLOW_REQUEST_MS, SLOW_QUERY_MS)
+
+if AUTO_MIGRATE:
+    migrate()
 
 app.register_blueprint(api_routes)
 
@@ -0,0 +1,15 @@
+"""ASGI entry point for serving the API from an async server.
+
+Usage:
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 8000
+
+The Flask app runs in a pool of ASGI_THREADS threads. While a request waits
+on the database it holds no GIL and no event loop, and the Turso driver
+overlaps the round trips of all threads on one event loop, so a single
+process keeps hundreds of queries in flight.
+"""
+from a2wsgi import WSGIMiddleware
+from app import app
+from config import ASGI_THREADS
+
+asgi_app = WSGIMiddleware(app, workers=ASGI_THREADS)
@@ -0,0 +1,268 @@
+"""Requests per second of the sync client path versus the concurrent paths.
+
+Serves the API from a throwaway local database behind the libsql client
+with an injected round trip latency (like a remote Turso database) and
+runs concurrent virtual users reading and updating their grades.
+
+Modes, each measured in a fresh process:
+    serial   libsql_client's sync client, one statement in flight per process
+    threads  the Turso driver's shared event loop, WSGI app in threads
+    asgi     the same driver behind asgi.py, requests as coroutines
+
+Usage:
+    python benchmarks/bench_async.py [--users 64] [--latency 20] [--duration 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+MODES = ("serial", "threads", "asgi")
+
+
+class LatencyClient:
+    """Async libsql client that waits ``latency`` seconds per round trip."""
+
+    def __init__(self, client, latency):
+        self._client = client
+        self._latency = latency
+
+    async def execute(self, sql, args=None):
+        await asyncio.sleep(self._latency)
+        return await self._client.execute(sql, args)
+
+    async def batch(self, statements):
+        await asyncio.sleep(self._latency)
+        return await self._client.batch(statements)
+
+    async def close(self):
+        await self._client.close()
+
+
+def create_db(url, latency, serial):
+    """Replace the shared client with one adding latency to every round trip."""
+    from libsql_client import create_client, create_client_sync
+    from config import db as shared
+    from turso_client import AsyncLoopClient
+
+    if serial:
+        db = create_client_sync(url)
+        db._client = LatencyClient(db._client, latency)
+    else:
+        db = AsyncLoopClient(lambda: LatencyClient(create_client(url), latency))
+    shared.set(db)
+    return db
+
+
+def populate(users):
+    """Register the virtual users, each with a few subjects and grades."""
+    from app import app
+    from grade_import import import_grades
+
+    client = app.test_client()
+    accounts = []
+    for number in range(users):
+        response = client.post(
+            "/register", json={"username": f"user{number}", "password": "secret"}
+        )
+        token = response.get_json()["token"]
+        user_id = client.get("/user", headers={"x-access-token": token}).get_json()["user"]["id"]
+        import_grades(
+            user_id,
+            (
+                {
+                    "subject_name": f"Subject {subject}",
+                    "date": "01.02.2024",
+                    "name": f"Exam {exam}",
+                    "grade": round(random.uniform(3, 6), 1),
+                }
+                for subject in range(6)
+                for exam in range(5)
+            ),
+        )
+        grades = client.get("/grades", headers={"x-access-token": token}).get_json()["grades"]
+        accounts.append((token, [grade["id"] for grade in grades]))
+    return accounts
+
+
+def pick_request(grade_ids):
+    """One request of the mix: mostly reads, every fifth a grade update."""
+    if random.random() < 0.2:
+        grade_id = random.choice(grade_ids)
+        return "PUT", f"/grades/{grade_id}", {"grade": round(random.uniform(3, 6), 1)}
+    return "GET", random.choice(("/subjects", "/grades", "/user")), None
+
+
+def run_threads(accounts, duration):
+    from app import app
+
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+
+    def virtual_user(token, grade_ids):
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            method, path, body = pick_request(grade_ids)
+            start = time.perf_counter()
+            response = client.open(
+                path, method=method, json=body, headers={"x-access-token": token}
+            )
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=virtual_user, args=account) for account in accounts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+async def asgi_request(asgi_app, method, path, token, body):
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"x-access-token", token.encode()),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 80),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.sleep(3600)
+        sent = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await asgi_app(scope, receive, send)
+    return status[0]
+
+
+def run_asgi(accounts, duration):
+    from asgi import asgi_app
+
+    latencies = []
+    errors = []
+
+    async def virtual_user(token, grade_ids, deadline):
+        while time.perf_counter() < deadline:
+            method, path, body = pick_request(grade_ids)
+            start = time.perf_counter()
+            status = await asgi_request(asgi_app, method, path, token, body)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+
+    async def main():
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(virtual_user(*account, deadline) for account in accounts))
+
+    asyncio.run(main())
+    return latencies, errors
+
+
+def measure(mode, args):
+    """Run one mode in this process and print its results as JSON."""
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as directory:
+        url = "file:" + os.path.join(directory, "bench.db")
+        db = create_db(url, args.latency / 1000, serial=mode == "serial")
+        try:
+            from migrations import migrate
+
+            migrate()
+            accounts = populate(args.users)
+            run = run_asgi if mode == "asgi" else run_threads
+            latencies, errors = run(accounts, args.duration)
+            latencies.sort()
+        finally:
+            db.close()
+
+    print(
+        json.dumps(
+            {
+                "requests": len(latencies),
+                "errors": len(errors),
+                "rps": len(latencies) / args.duration,
+                "p50": latencies[len(latencies) // 2] * 1000,
+                "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=64, help="concurrent virtual users")
+    parser.add_argument("--latency", type=float, default=20, help="round trip latency in ms")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per mode")
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        measure(args.mode, args)
+        return
+
+    # Cheap hashes and no response cache, every request reaches the database
+    env = dict(
+        os.environ,
+        DB_URL="file:unused.db",
+        DB_AUTH_TOKEN="unused",
+        DB_DRIVER="turso",
+        CACHE_TTL="0",
+        HASH_WORKERS="0",
+        PASSWORD_HASH_METHOD="pbkdf2:sha256:1000",
+        ASGI_THREADS=str(args.users),
+    )
+    print(f"{args.users} virtual users, {args.latency:g} ms per round trip")
+    print(f"{'mode':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, *sys.argv[1:]],
+            env=env,
+            cwd=tempfile.gettempdir(),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:<10}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.1f}"
+            f"{result['p50']:>10.1f}{result['p95']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Editing several grades: separate requests versus one POST /batch.
+
+Serves the API from a throwaway local database behind the libsql client
+with an injected round trip latency (like a remote Turso database) and
+applies the same edits (grade updates, additions and deletions) once as
+separate PUT/POST/DELETE requests and once as a single POST /batch.
+Reports the HTTP requests, database round trips and time of each.
+
+Usage:
+    python benchmarks/bench_batch.py [--edits 10] [--latency 0,20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_overview import CountingClient, populate
+
+
+def edits(grade_ids, count):
+    """``count`` operations: updates, additions and deletions of grades."""
+    operations = []
+    for number in range(count):
+        kind = number % 3
+        if kind == 0:
+            operations.append({"op": "update_grade", "id": grade_ids.pop(), "grade": round(random.uniform(3, 6), 1)})
+        elif kind == 1:
+            operations.append(
+                {"op": "add_grade", "subject_name": "Subject 0", "date": "2024-06-01", "name": f"New {number}", "grade": 5}
+            )
+        else:
+            operations.append({"op": "delete_grade", "id": grade_ids.pop()})
+    return operations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edits", type=int, default=10, help="operations per load")
+    parser.add_argument("--latency", default="0,20", help="round trip latencies in ms")
+    parser.add_argument("--samples", type=int, default=10, help="loads per measurement")
+    args = parser.parse_args()
+
+    random.seed(1)
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "batch.db")
+    os.environ.update(
+        DB_DRIVER="turso",
+        DB_URL="file:" + path,
+        DB_AUTH_TOKEN="unused",
+        HASH_WORKERS="0",
+    )
+    populate(path, 6, 20)
+
+    from libsql_client import create_client
+    from app import app
+    from APIendpoints.api import create_token
+    from config import db as shared
+    from turso_client import AsyncLoopClient
+
+    client = app.test_client()
+    with app.app_context():
+        token = create_token("user1", 1)
+    headers = {"x-access-token": token}
+
+    def grade_ids():
+        return [grade["id"] for grade in client.get("/grades", headers=headers).get_json()["grades"]]
+
+    def separate_requests(operations):
+        for operation in operations:
+            if operation["op"] == "update_grade":
+                response = client.put(f"/grades/{operation['id']}", json={"grade": operation["grade"]}, headers=headers)
+            elif operation["op"] == "add_grade":
+                body = {key: value for key, value in operation.items() if key != "op"}
+                response = client.post("/grades", json=dict(body, weight=1, details=""), headers=headers)
+            else:
+                response = client.delete(f"/grades/{operation['id']}", headers=headers)
+            assert response.status_code == 200, response.get_json()
+        return len(operations)
+
+    def one_batch(operations):
+        response = client.post("/batch", json={"operations": operations}, headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return 1
+
+    print(f"{args.edits} edits")
+    print(f"{'latency':>8}  {'load':<18}{'requests':>9}{'round trips':>12}{'median ms':>11}")
+    for latency in (float(value) for value in args.latency.split(",")):
+        shared.set(AsyncLoopClient(lambda: CountingClient(create_client("file:" + path), latency / 1000)))
+        for label, load in (("separate requests", separate_requests), ("POST /batch", one_batch)):
+            timings = []
+            for _ in range(args.samples):
+                operations = edits(grade_ids(), args.edits)
+                CountingClient.round_trips = 0
+                start = time.perf_counter()
+                requests = load(operations)
+                timings.append(time.perf_counter() - start)
+            print(
+                f"{latency:>6.0f}ms  {label:<18}{requests:>9}{CountingClient.round_trips:>12}"
+                f"{statistics.median(timings) * 1000:>11.1f}"
+            )
+        shared.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Cold start time of the app: import, first page and first database request.
+
+Starts fresh interpreters like a serverless platform does for a new
+instance and measures, per process, the time to import ``app``, the first
+request of each static page and the first request that queries the
+database (a login, against a local file through the Turso driver).
+
+Usage:
+    python benchmarks/bench_cold_start.py [--runs 10] [--repo PATH]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PAGES = ("/", "/docs", "/sitemap.xml")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+timings = {"import app": time.perf_counter() - start}
+client = app.app.test_client()
+for path in sys.argv[1:]:
+    start = time.perf_counter()
+    client.get(path)
+    timings["first " + path] = time.perf_counter() - start
+start = time.perf_counter()
+client.post("/login", json={"username": "nobody", "password": "secret"})
+timings["first login (db)"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def create_users_table(path):
+    # Created here rather than through migrations.py, so older checkouts
+    # whose config connects at import can be measured too
+    con = sqlite3.connect(path)
+    con.execute(
+        """CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL
+        )"""
+    )
+    con.commit()
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes to start")
+    parser.add_argument("--repo", type=Path, default=ROOT, help="checkout to measure")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cold.db")
+        create_users_table(path)
+        env = dict(
+            os.environ,
+            DB_DRIVER="turso",
+            DB_URL="file:" + path,
+            DB_AUTH_TOKEN="unused",
+            HASH_WORKERS="0",
+        )
+        runs = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", CHILD, *PAGES],
+                cwd=args.repo,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            total = time.perf_counter() - start
+            timings = json.loads(output.strip().splitlines()[-1])
+            timings["process total"] = total
+            runs.append(timings)
+
+    print(f"{args.runs} cold starts of {args.repo}")
+    print(f"{'step':<22}{'median ms':>12}{'min ms':>10}")
+    for step in runs[0]:
+        values = [run[step] * 1000 for run in runs]
+        print(f"{step:<22}{statistics.median(values):>12.1f}{min(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Micro-benchmark of grade_math.py for 1, 100 and 10k grades.
+
+For every size, random grades over six subjects are aggregated
+    - in memory with a Gradebook (rows, per-subject sums, user totals),
+    - with the SQL of aggregates.py on an in-memory SQLite database,
+and the required grade and the statistics of GET /stats are computed.
+The in-memory results are checked against the SQL ones before timing.
+
+Usage:
+    python benchmarks/bench_grade_math.py [--sizes 1,100,10000] [--seconds 0.5]
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aggregates import aggregate_statements
+from grade_math import Gradebook, GradeRow, SubjectRow
+from grade_stats import compute_stats
+
+SUBJECTS = 6
+
+
+def random_grades(size):
+    """``(id, subject_id, date, grade, weight)`` tuples in date order."""
+    grades = [
+        (
+            number + 1,
+            random.randint(1, SUBJECTS),
+            f"{random.randint(2020, 2025)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+            random.choice([0, round(random.uniform(1, 6), 2)]) if number % 10 == 0 else round(random.uniform(1, 6), 2),
+            random.choice([0.5, 1, 2]),
+        )
+        for number in range(size)
+    ]
+    return sorted(grades, key=lambda grade: (grade[2], grade[0]))
+
+
+def sql_database(grades):
+    con = sqlite3.connect(":memory:")
+    con.executescript(
+        """
+        CREATE TABLE users (id INTEGER PRIMARY KEY, total_average REAL, total_points INTEGER,
+            total_exams INTEGER, last_modified TIMESTAMP);
+        CREATE TABLE subjects (id INTEGER PRIMARY KEY, name TEXT, average REAL, points INTEGER,
+            num_exams INTEGER, weight REAL DEFAULT 1, user_id INTEGER);
+        CREATE TABLE grades (id INTEGER PRIMARY KEY, date TEXT, grade FLOAT, weight REAL,
+            user_id INTEGER, subject_id INTEGER);
+        CREATE INDEX idx_grades_user_subject ON grades(user_id, subject_id);
+        INSERT INTO users (id) VALUES (1);
+        """
+    )
+    con.executemany(
+        "INSERT INTO subjects (id, name, weight, user_id) VALUES (?, ?, ?, 1)",
+        [(number, f"Subject {number}", 0.5 if number == 1 else 1) for number in range(1, SUBJECTS + 1)],
+    )
+    con.executemany(
+        "INSERT INTO grades (id, subject_id, date, grade, weight, user_id) VALUES (?, ?, ?, ?, ?, 1)",
+        grades,
+    )
+    return con
+
+
+def sql_aggregates(con):
+    for sql, args in aggregate_statements(1):
+        con.execute(sql, args)
+    return con.execute("SELECT total_average, total_points, total_exams FROM users").fetchone()
+
+
+def subject_rows():
+    return [
+        SubjectRow(number, f"Subject {number}", 0.5 if number == 1 else 1)
+        for number in range(1, SUBJECTS + 1)
+    ]
+
+
+def memory_aggregates(grades):
+    gradebook = Gradebook(
+        subject_rows(), [GradeRow(subject_id, grade, weight) for _, subject_id, _, grade, weight in grades]
+    )
+    totals = gradebook.totals()
+    return gradebook, (totals["total_average"], totals["total_points"], totals["total_exams"])
+
+
+def timed(function, seconds):
+    """Median microseconds per call over repeated batches of calls."""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds / 5:
+            break
+        calls *= 2
+    timings = [elapsed / calls]
+    for _ in range(4):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        timings.append((time.perf_counter() - start) / calls)
+    return sorted(timings)[2] * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1,100,10000", help="grades per user")
+    parser.add_argument("--seconds", type=float, default=0.5, help="time per measurement")
+    args = parser.parse_args()
+
+    random.seed(1)
+    print(f"{'grades':>8}  {'operation':<36}{'us/call':>12}")
+    for size in (int(size) for size in args.sizes.split(",")):
+        grades = random_grades(size)
+        con = sql_database(grades)
+
+        expected = sql_aggregates(con)
+        gradebook, totals = memory_aggregates(grades)
+        assert totals[0] == expected[0] and totals[2] == expected[2], (totals, expected)
+        assert abs(totals[1] - expected[1]) < 1e-9, (totals, expected)
+        stored = con.execute("SELECT id, average, points, num_exams FROM subjects").fetchall()
+        for subject_id, average, points, num_exams in stored:
+            subject = gradebook.subject(subject_id)
+            assert (subject.average, subject.points, subject.num_exams) == (average, points, num_exams)
+
+        stats_grades = [
+            {"id": grade_id, "subject_id": subject_id, "name": "", "date": date, "grade": grade, "weight": weight}
+            for grade_id, subject_id, date, grade, weight in grades
+        ]
+        stats_subjects = [
+            {"id": subject.id, "name": subject.name, "weight": subject.weight} for subject in subject_rows()
+        ]
+        operations = {
+            "aggregates, grade_math": lambda: memory_aggregates(grades),
+            "aggregates, SQL (aggregates.py)": lambda: sql_aggregates(con),
+            "required grade (total, 0.01)": lambda: gradebook.required_grade(1, totals[0] + 0.05),
+            "statistics (semester, window 5)": lambda: compute_stats(stats_subjects, stats_grades),
+        }
+        for label, function in operations.items():
+            print(f"{size:>8}  {label:<36}{timed(function, args.seconds):>12.1f}")
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
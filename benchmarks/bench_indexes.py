@@ -0,0 +1,134 @@
+"""Query time of the API's lookups before and after the lookup indexes.
+
+Builds a throwaway local SQLite database with the production schema, fills
+it with synthetic users, then times the queries the API runs per request
+without and with the indexes of migration 3.
+
+Usage:
+    python benchmarks/bench_indexes.py [--users 10000] [--subjects 12] [--grades 15]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aggregates import subject_aggregates_statement  # noqa: E402
+from migrations import (  # noqa: E402
+    CREATE_GRADES_TABLE,
+    CREATE_SUBJECTS_TABLE,
+    CREATE_USERS_TABLE,
+    MIGRATIONS,
+)
+
+QUERIES = {
+    "list subjects": (
+        "SELECT id, name, average, points, num_exams, weight FROM subjects WHERE user_id=?",
+        lambda user, subject_id, number: [user],
+    ),
+    "subject by name": (
+        "SELECT id FROM subjects WHERE name=? AND user_id=?",
+        lambda user, subject_id, number: [f"Subject {number}", user],
+    ),
+    "subject grades": (
+        "SELECT id, name, grade, weight, date, details FROM grades WHERE subject_id=? AND user_id=?",
+        lambda user, subject_id, number: [subject_id, user],
+    ),
+    "list grades with subject": (
+        """SELECT g.id, g.name, g.grade, g.weight, g.date, g.details,
+            COALESCE(s.name, 'Unknown') AS subject
+        FROM grades g
+        LEFT JOIN subjects s ON s.id = g.subject_id AND s.user_id = g.user_id
+        WHERE g.user_id=?""",
+        lambda user, subject_id, number: [user],
+    ),
+    "recompute subjects": (
+        subject_aggregates_statement(0)[0],
+        lambda user, subject_id, number: [user],
+    ),
+}
+
+
+def populate(con, users, subjects, grades):
+    for sql in (CREATE_USERS_TABLE, CREATE_SUBJECTS_TABLE, CREATE_GRADES_TABLE):
+        con.execute(sql)
+    con.executemany(
+        "INSERT INTO users (id, username, password) VALUES (?, ?, '')",
+        ((user, f"user{user}") for user in range(1, users + 1)),
+    )
+    con.executemany(
+        "INSERT INTO subjects (id, name, user_id) VALUES (?, ?, ?)",
+        (
+            ((user - 1) * subjects + number, f"Subject {number}", user)
+            for user in range(1, users + 1)
+            for number in range(1, subjects + 1)
+        ),
+    )
+    # Grades are inserted round-robin over users, like real usage spreads
+    # them over time, so one user's rows are not stored next to each other
+    con.executemany(
+        "INSERT INTO grades (date, name, grade, weight, user_id, subject_id) VALUES ('2024-01-01', 'Exam', ?, 1, ?, ?)",
+        (
+            (round(random.uniform(1, 6), 1), user, (user - 1) * subjects + number)
+            for _ in range(grades)
+            for number in range(1, subjects + 1)
+            for user in range(1, users + 1)
+        ),
+    )
+    con.commit()
+
+
+def run_queries(con, users, subjects, samples):
+    picks = [
+        (random.randint(1, users), random.randint(1, subjects)) for _ in range(samples)
+    ]
+    timings = {}
+    for label, (sql, params) in QUERIES.items():
+        start = time.perf_counter()
+        for user, number in picks:
+            subject_id = (user - 1) * subjects + number
+            con.execute(sql, params(user, subject_id, number)).fetchall()
+        timings[label] = (time.perf_counter() - start) / samples * 1000
+    con.rollback()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--subjects", type=int, default=12, help="subjects per user")
+    parser.add_argument("--grades", type=int, default=15, help="grades per subject")
+    parser.add_argument("--samples", type=int, default=5, help="queries per measurement")
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as directory:
+        con = sqlite3.connect(os.path.join(directory, "bench.db"))
+        start = time.perf_counter()
+        populate(con, args.users, args.subjects, args.grades)
+        rows = args.users * args.subjects * args.grades
+        print(f"Populated {args.users} users, {rows} grades in {time.perf_counter() - start:.1f}s")
+
+        before = run_queries(con, args.users, args.subjects, args.samples)
+        indexes = next(statements for version, _, statements in MIGRATIONS if version == 3)
+        for sql in indexes:
+            con.execute(sql)
+        con.commit()
+        after = run_queries(con, args.users, args.subjects, args.samples)
+        con.close()
+
+    print(f"{'query':<26}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for label in QUERIES:
+        print(
+            f"{label:<26}{before[label]:>12.3f}{after[label]:>12.3f}"
+            f"{before[label] / after[label]:>9.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
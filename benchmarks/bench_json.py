@@ -0,0 +1,131 @@
+"""Serialization cost of large grade listings.
+
+Builds a throwaway local SQLite database (sqlite driver) with one user of
+10k grades and requests ``GET /grades`` and ``GET /subjects/<id>/grades``
+with each JSON provider, with the response cache off (rows are fetched and
+encoded on every request) and on (cached listings are reused). Each
+provider runs in its own process since it is chosen when the app starts.
+
+It also times the rows-to-JSON step alone: copying each field out of the
+libsql rows and encoding with the standard library, as the listings did
+before, against ``encode_rows`` with orjson.
+
+Usage:
+    python benchmarks/bench_json.py [--grades 10000] [--samples 20]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+CHILD = """
+import json, statistics, sys, time
+from app import app
+from APIendpoints.api import create_token
+
+samples = int(sys.argv[1])
+client = app.test_client()
+with app.app_context():
+    token = create_token("user1", 1)
+timings = {}
+for path in ("/grades", "/subjects/1/grades"):
+    values = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        response = client.get(path, headers={"x-access-token": token})
+        values.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data[:200]
+    timings[path] = [statistics.median(values) * 1000, len(response.data)]
+print(json.dumps(timings))
+"""
+
+
+def row_step(path, samples):
+    """Median ms of encoding all rows, field by field with json and with encode_rows."""
+    import sqlite3
+    from app import app
+    from APIendpoints.listing import GRADE_FIELDS
+    from APIendpoints.serialization import encode_rows
+    from storage import _result_set
+
+    fields = [field for field in GRADE_FIELDS if field != "subject"]
+    con = sqlite3.connect(path)
+    rows = _result_set(con.execute(f"SELECT {', '.join(fields)} FROM grades")).rows
+    con.close()
+
+    def median_ms(function):
+        values = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            function()
+            values.append(time.perf_counter() - start)
+        return statistics.median(values) * 1000
+
+    with app.app_context():
+        per_field = median_ms(
+            lambda: json.dumps(
+                [{field: row[field] for field in fields} for row in rows],
+                sort_keys=True,
+                separators=(",", ":"),
+            )
+        )
+        encoded = median_ms(lambda: encode_rows(fields, rows))
+        provider = type(app.json).__name__
+    return per_field, encoded, provider
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--grades", type=int, default=10000, help="grades of the user")
+    parser.add_argument("--samples", type=int, default=20, help="requests per measurement")
+    args = parser.parse_args()
+
+    random.seed(1)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "json.db")
+    os.environ.update(DB_DRIVER="sqlite", DB_PATH=path)
+
+    from bench_pagination import populate
+
+    populate(path, [args.grades])
+
+    print(f"{args.grades} grades")
+    print(f"{'provider':<10}{'cache':<7}{'request':<22}{'median ms':>10}{'bytes':>10}")
+    for provider in ("default", "orjson"):
+        for cache_ttl in ("0", "60"):
+            env = dict(os.environ, JSON_PROVIDER=provider, CACHE_TTL=cache_ttl)
+            output = subprocess.run(
+                [sys.executable, "-c", CHILD, str(args.samples)],
+                cwd=ROOT,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            timings = json.loads(output.strip().splitlines()[-1])
+            for request, (milliseconds, size) in timings.items():
+                cache = "on" if cache_ttl != "0" else "off"
+                print(f"{provider:<10}{cache:<7}{request:<22}{milliseconds:>10.2f}{size:>10}")
+
+    per_field, encoded, provider = row_step(path, args.samples)
+    print(f"\nrows to JSON, field by field + json: {per_field:.2f} ms")
+    print(f"rows to JSON, encode_rows ({provider}): {encoded:.2f} ms")
+
+    from config import close_db
+
+    close_db()
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Client start-up: separate requests versus one GET /overview.
+
+Serves the API from a throwaway local database behind the libsql client
+with an injected round trip latency (like a remote Turso database) and the
+response cache off, and loads one user's gradebook the way clients did
+(GET /user, GET /subjects, then GET /subjects/<id>/grades per subject)
+and with GET /overview. Reports the HTTP requests, database round trips
+and time of each.
+
+Usage:
+    python benchmarks/bench_overview.py [--subjects 12] [--grades 20] [--latency 0,20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_async import LatencyClient
+
+
+class CountingClient(LatencyClient):
+    """LatencyClient that counts its round trips."""
+
+    round_trips = 0
+
+    async def execute(self, sql, args=None):
+        CountingClient.round_trips += 1
+        return await super().execute(sql, args)
+
+    async def batch(self, statements):
+        CountingClient.round_trips += 1
+        return await super().batch(statements)
+
+
+def populate(path, subjects, grades):
+    """One user with ``subjects`` subjects of ``grades`` grades each."""
+    from aggregates import aggregate_statements
+    from migrations import migrate
+
+    migrate()
+    con = sqlite3.connect(path)
+    con.execute("INSERT INTO users (id, username, password) VALUES (1, 'user1', '')")
+    for number in range(subjects):
+        subject_id = con.execute(
+            "INSERT INTO subjects (name, user_id) VALUES (?, 1)", [f"Subject {number}"]
+        ).lastrowid
+        con.executemany(
+            "INSERT INTO grades (date, name, grade, weight, user_id, subject_id) VALUES (?, ?, ?, 1, 1, ?)",
+            [
+                (f"2024-{random.randint(1, 12):02d}-01", f"Exam {exam}", round(random.uniform(3, 6), 1), subject_id)
+                for exam in range(grades)
+            ],
+        )
+    for sql, args in aggregate_statements(1):
+        con.execute(sql, args)
+    con.commit()
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subjects", type=int, default=12, help="subjects of the user")
+    parser.add_argument("--grades", type=int, default=20, help="grades per subject")
+    parser.add_argument("--latency", default="0,20", help="round trip latencies in ms")
+    parser.add_argument("--samples", type=int, default=10, help="loads per measurement")
+    args = parser.parse_args()
+
+    random.seed(1)
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "overview.db")
+    os.environ.update(
+        DB_DRIVER="turso",
+        DB_URL="file:" + path,
+        DB_AUTH_TOKEN="unused",
+        CACHE_TTL="0",
+        HASH_WORKERS="0",
+    )
+    populate(path, args.subjects, args.grades)
+
+    from libsql_client import create_client
+    from app import app
+    from APIendpoints.api import create_token
+    from config import db as shared
+    from turso_client import AsyncLoopClient
+
+    client = app.test_client()
+    with app.app_context():
+        token = create_token("user1", 1)
+    headers = {"x-access-token": token}
+
+    def separate_calls():
+        requests = 2
+        client.get("/user", headers=headers)
+        subjects = client.get("/subjects", headers=headers).get_json()["subjects"]
+        for subject in subjects:
+            client.get(f"/subjects/{subject['id']}/grades", headers=headers)
+            requests += 1
+        return requests
+
+    def overview():
+        response = client.get("/overview", headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return 1
+
+    print(f"{args.subjects} subjects with {args.grades} grades each")
+    print(f"{'latency':>8}  {'load':<16}{'requests':>9}{'round trips':>12}{'median ms':>11}")
+    for latency in (float(value) for value in args.latency.split(",")):
+        shared.set(AsyncLoopClient(lambda: CountingClient(create_client("file:" + path), latency / 1000)))
+        for label, load in (("separate calls", separate_calls), ("GET /overview", overview)):
+            timings = []
+            for _ in range(args.samples):
+                CountingClient.round_trips = 0
+                start = time.perf_counter()
+                requests = load()
+                timings.append(time.perf_counter() - start)
+            print(
+                f"{latency:>6.0f}ms  {label:<16}{requests:>9}{CountingClient.round_trips:>12}"
+                f"{statistics.median(timings) * 1000:>11.1f}"
+            )
+        shared.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
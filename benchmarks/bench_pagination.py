@@ -0,0 +1,115 @@
+"""Latency and response size of grade listings as a user's history grows.
+
+Builds a throwaway local SQLite database (sqlite driver) with users of
+increasing history and requests, with the response cache off, the full
+listing, the first page, a page at the end of the history (keyset cursor)
+and the first page sorted by date.
+
+Usage:
+    python benchmarks/bench_pagination.py [--sizes 1000,10000,50000] [--limit 50]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def populate(path, sizes):
+    """Create one user per size with that many grades over six subjects."""
+    from migrations import migrate
+
+    migrate()
+    con = sqlite3.connect(path)
+    for user_id, size in enumerate(sizes, start=1):
+        con.execute(
+            "INSERT INTO users (id, username, password) VALUES (?, ?, '')",
+            [user_id, f"user{user_id}"],
+        )
+        subject_ids = [
+            con.execute(
+                "INSERT INTO subjects (name, user_id) VALUES (?, ?)",
+                [f"Subject {number}", user_id],
+            ).lastrowid
+            for number in range(6)
+        ]
+        con.executemany(
+            "INSERT INTO grades (date, name, grade, weight, user_id, subject_id) VALUES (?, ?, ?, 1, ?, ?)",
+            (
+                (
+                    f"{random.randint(1, 28):02d}.{random.randint(1, 12):02d}.{random.randint(2015, 2025)}",
+                    f"Exam {number}",
+                    round(random.uniform(1, 6), 1),
+                    user_id,
+                    random.choice(subject_ids),
+                )
+                for number in range(size)
+            ),
+        )
+    con.commit()
+    con.close()
+
+
+def timed(client, url, token, samples):
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        response = client.get(url, headers={"x-access-token": token})
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_json()
+    return statistics.median(timings) * 1000, len(response.data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,50000", help="grades per user")
+    parser.add_argument("--limit", type=int, default=50, help="page size")
+    parser.add_argument("--samples", type=int, default=5, help="requests per measurement")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    random.seed(1)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "pagination.db")
+    os.environ.update(DB_DRIVER="sqlite", DB_PATH=path, CACHE_TTL="0")
+    populate(path, sizes)
+
+    from app import app
+    from APIendpoints.api import create_token
+    from APIendpoints.listing import encode_cursor
+
+    client = app.test_client()
+    print(f"{'grades':>8}  {'request':<28}{'median ms':>10}{'bytes':>10}")
+    for user_id, size in enumerate(sizes, start=1):
+        with app.app_context():
+            token = create_token(f"user{user_id}", user_id)
+        last_id = client.get(
+            "/grades?limit=1&sort=-id&fields=id", headers={"x-access-token": token}
+        ).get_json()["grades"][0]["id"]
+        tail = encode_cursor("id", [last_id - args.limit - 1] * 2)
+        requests = {
+            "full listing": "/grades",
+            "first page": f"/grades?limit={args.limit}",
+            "last page (cursor)": f"/grades?limit={args.limit}&cursor={tail}",
+            "first page by date": f"/grades?limit={args.limit}&sort=-date",
+            "first page, id+grade": f"/grades?limit={args.limit}&fields=id,grade",
+        }
+        for label, url in requests.items():
+            milliseconds, size_bytes = timed(client, url, token, args.samples)
+            print(f"{size:>8}  {label:<28}{milliseconds:>10.2f}{size_bytes:>10}")
+
+    from config import close_db
+
+    close_db()
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
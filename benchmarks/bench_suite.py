@@ -0,0 +1,386 @@
+"""Load test of every endpoint against a local stand-in database.
+
+Boots the app in this process on a throwaway database (libsql's local
+file client behind the Turso driver, or the sqlite driver) and adds
+``--latency`` ms to every round trip to mimic HTTPS requests to Turso.
+Concurrent virtual users then run a scenario calling every endpoint of the
+API, and the suite reports per route the requests, errors, p50/p95/p99
+latency and the database statements per request (counted by
+APIendpoints/metrics.py), and the overall throughput.
+
+With ``--check`` the run fails (exit status 1) when a request returns an
+unexpected status, an endpoint was not called, or a route ran more
+statements in one request than its budget in benchmarks/budgets.json.
+Statement counts do not depend on the machine, so CI catches N+1 queries
+without flaky timing budgets; routes may also get a "p95_ms" budget for
+stable runners. ``--write-budgets`` stores the statements of the current
+run as the new budgets.
+
+Usage:
+    python benchmarks/bench_suite.py [--users 8] [--iterations 5] [--latency 0]
+    python benchmarks/bench_suite.py --check
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+BUDGETS = Path(__file__).resolve().parent / "budgets.json"
+
+PASSWORD = "secret"
+
+
+class DelayedClient:
+    """Database client that waits ``latency`` seconds before every round trip."""
+
+    def __init__(self, client, latency=0):
+        self._client = client
+        self.latency = latency
+
+    def execute(self, sql, args=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._client.execute(sql, args)
+
+    def batch(self, statements):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._client.batch(statements)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class Recorder:
+    """Latency, statements and status of every request, per route."""
+
+    def __init__(self):
+        self.samples = {}
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, statements, status, expected, path):
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, statements, status == expected))
+            if status != expected:
+                self.failures.append(f"{route[0]} {path}: {status}, expected {expected}")
+
+
+class VirtualUser:
+    """Test client with a user's token that records its requests."""
+
+    def __init__(self, app, recorder, username, token=None):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.username = username
+        self.token = token
+
+    def call(self, method, path, body=None, expected=200, token=None, headers=None, data=None):
+        headers = dict(headers or {})
+        token = token or self.token
+        if token:
+            headers["x-access-token"] = token
+        start = time.perf_counter()
+        if data is not None:
+            response = self.client.open(path, method=method, data=data, headers=headers)
+        else:
+            response = self.client.open(path, method=method, json=body, headers=headers)
+        seconds = time.perf_counter() - start
+        route = (method, response.headers.get("X-Bench-Route", "<unmatched>"))
+        statements = int(response.headers.get("X-Bench-Statements", 0))
+        self.recorder.add(route, seconds, statements, response.status_code, expected, path)
+        return response
+
+    def json(self, *args, **kwargs):
+        return self.call(*args, **kwargs).get_json() or {}
+
+
+def ndjson(subject, grades):
+    return "\n".join(
+        json.dumps(
+            {
+                "subject_name": subject,
+                "date": f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+                "name": f"Exam {number}",
+                "grade": round(random.uniform(3, 6), 1),
+                "weight": random.choice((0.5, 1, 2)),
+                "details": "",
+            }
+        )
+        for number in range(grades)
+    )
+
+
+def seed(user, subjects, grades):
+    """Register the user and import ``subjects`` subjects of ``grades`` grades."""
+    user.token = user.json("POST", "/register", {"username": user.username, "password": PASSWORD}, 201)["token"]
+    for number in range(subjects):
+        user.call(
+            "POST",
+            "/grades/bulk",
+            data=ndjson(f"Subject {number}", grades),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+
+def scenario(user, iteration):
+    """One pass of a user over the grade, subject, statistics and account routes."""
+    user.call("GET", "/user")
+    subjects = user.json("GET", "/subjects")["subjects"]
+    subject_id = subjects[iteration % len(subjects)]["id"]
+    user.call("GET", f"/subjects/{subject_id}")
+    grades = user.json("GET", f"/subjects/{subject_id}/grades")["grades"]
+    user.call("GET", "/grades")
+    user.call("GET", "/grades?limit=20&sort=-date")
+    user.call("GET", f"/grades/{grades[0]['id']}")
+    user.call("GET", "/overview")
+    user.call("GET", "/stats")
+    user.call("GET", "/stats?period=month&window=10")
+    user.call(
+        "POST",
+        "/simulate",
+        {
+            "grades": [{"subject_id": subject_id, "grade": 5.5, "weight": 1}],
+            "remove": [grades[-1]["id"]],
+            "target": {"subject_id": subject_id, "average": 5, "weight": 1},
+        },
+    )
+
+    new_subject = user.json("POST", "/subjects", {"name": f"Extra {iteration}", "weight": 1})["id"]
+    user.call("PUT", f"/subjects/{new_subject}", {"name": f"Extra {iteration}", "weight": 2})
+    grade_id = user.json(
+        "POST",
+        "/grades",
+        {
+            "subject_id": new_subject,
+            "date": "2024-05-01",
+            "name": "Quiz",
+            "grade": 5,
+            "weight": 1,
+            "details": "",
+        },
+    )["id"]
+    user.call("PUT", f"/grades/{grade_id}", {"grade": 4.5, "details": "retake"})
+    user.call("DELETE", f"/grades/{grade_id}")
+    user.call(
+        "POST",
+        "/batch",
+        {
+            "operations": [
+                {"op": "add_grade", "subject_id": new_subject, "date": "2024-06-01", "name": "Test", "grade": 6},
+                {"op": "add_grade", "subject_name": f"Batch {iteration}", "date": "2024-06-02", "name": "Test", "grade": 4},
+                {"op": "update_grade", "id": grades[0]["id"], "grade": grades[0]["grade"]},
+                {"op": "update_subject", "id": new_subject, "weight": 1},
+            ]
+        },
+    )
+    user.call(
+        "POST",
+        "/grades/bulk",
+        data=ndjson(f"Bulk {iteration}", 3),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    user.call("DELETE", f"/subjects/{new_subject}")
+
+    user.call("POST", "/login", {"username": user.username, "password": PASSWORD})
+    user.call("PUT", "/user/update_password", {"old_password": PASSWORD, "new_password": PASSWORD})
+    renamed = f"{user.username}-renamed"
+    token = user.json("PUT", "/user/update_username", {"username": renamed, "password": PASSWORD})["token"]
+    user.token = user.json(
+        "PUT", "/user/update_username", {"username": user.username, "password": PASSWORD}, token=token
+    )["token"]
+
+    temporary = f"{user.username}-tmp{iteration}"
+    token = user.json("POST", "/register", {"username": temporary, "password": PASSWORD}, 201)["token"]
+    user.call("DELETE", "/user", token=token)
+
+
+def admin_pass(admin, iteration):
+    """
+    The admin routes, run by the first user after the concurrent scenarios.
+
+    Deleting a user clears the admin cache, so running them alone keeps
+    their statement counts the same from run to run, and the profiled
+    request does not profile the other users' requests.
+    """
+    user_id = admin.json("GET", "/user")["user"]["id"]
+    profiled = admin.call("GET", "/grades", headers={"X-Profile": "1"})
+    admin.call("GET", "/profiles")
+    admin.call("GET", f"/profiles/{profiled.headers['X-Profile-Id']}")
+    admin.call("GET", "/cache/stats")
+    admin.call("GET", "/metrics")
+    temporary = f"{admin.username}-deleted{iteration}"
+    token = admin.json("PUT", "/register", {"username": temporary, "password": PASSWORD}, 201)["token"]
+    other_id = admin.json("GET", "/user", token=token)["user"]["id"]
+    assert other_id != user_id
+    admin.call("DELETE", f"/user/{other_id}")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def report(recorder, requests, seconds):
+    """Table of the routes, and the throughput of ``requests`` in ``seconds``."""
+    print(
+        f"{'route':<40}{'requests':>9}{'errors':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'stmts avg':>10}{'max':>5}"
+    )
+    latencies = []
+    for (method, route), samples in sorted(recorder.samples.items(), key=lambda item: item[0][::-1]):
+        timings = sorted(sample[0] * 1000 for sample in samples)
+        latencies += timings
+        statements = [sample[1] for sample in samples]
+        errors = sum(1 for sample in samples if not sample[2])
+        print(
+            f"{method + ' ' + route:<40}{len(samples):>9}{errors:>7}"
+            f"{percentile(timings, 0.5):>9.2f}{percentile(timings, 0.95):>9.2f}{percentile(timings, 0.99):>9.2f}"
+            f"{sum(statements) / len(statements):>10.2f}{max(statements):>5}"
+        )
+    latencies.sort()
+    print(
+        f"\nConcurrent scenarios: {requests} requests in {seconds:.2f} s, {requests / seconds:.1f} req/s"
+        f"\nAll requests: p50 {percentile(latencies, 0.5):.2f} ms, p95 {percentile(latencies, 0.95):.2f} ms, "
+        f"p99 {percentile(latencies, 0.99):.2f} ms"
+    )
+
+
+def check(recorder, routes, budgets):
+    """Problems of the run: failed requests, uncalled routes and exceeded budgets."""
+    problems = list(recorder.failures)
+    problems += [f"{method} {route}: not called" for method, route in sorted(routes - set(recorder.samples))]
+    for (method, route), samples in sorted(recorder.samples.items()):
+        budget = budgets.get(f"{method} {route}")
+        if budget is None:
+            problems.append(f"{method} {route}: no budget in {BUDGETS.name}")
+            continue
+        statements = max(sample[1] for sample in samples)
+        if statements > budget["statements"]:
+            problems.append(f"{method} {route}: {statements} statements, budget {budget['statements']}")
+        if "p95_ms" in budget:
+            p95 = percentile(sorted(sample[0] * 1000 for sample in samples), 0.95)
+            if p95 > budget["p95_ms"]:
+                problems.append(f"{method} {route}: p95 {p95:.1f} ms, budget {budget['p95_ms']} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--iterations", type=int, default=5, help="scenario passes per user")
+    parser.add_argument("--latency", type=float, default=0, help="round trip latency in ms")
+    parser.add_argument("--driver", choices=("turso", "sqlite"), default="turso", help="storage driver")
+    parser.add_argument("--subjects", type=int, default=6, help="subjects per user")
+    parser.add_argument("--grades", type=int, default=20, help="grades per subject")
+    parser.add_argument("--check", action="store_true", help="fail on errors or exceeded budgets")
+    parser.add_argument("--write-budgets", action="store_true", help="store the statements as budgets")
+    args = parser.parse_args()
+
+    random.seed(1)
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "suite.db")
+    # Cheap hashes so the accounts routes do not drown out the rest
+    os.environ.update(
+        DB_DRIVER=args.driver,
+        DB_URL="file:" + path,
+        DB_AUTH_TOKEN="unused",
+        DB_PATH=path,
+        HASH_WORKERS="0",
+        PASSWORD_HASH_METHOD="pbkdf2:sha256:1000",
+    )
+
+    from flask import request
+    from app import app
+    from APIendpoints.metrics import current_request_stats
+    from config import connect_db, db
+    from migrations import migrate
+
+    @app.after_request
+    def bench_headers(response):
+        response.headers["X-Bench-Route"] = request.url_rule.rule if request.url_rule else "<unmatched>"
+        response.headers["X-Bench-Statements"] = str(current_request_stats().statements)
+        return response
+
+    client = DelayedClient(connect_db())
+    db.set(client)
+    migrate()
+
+    seeding = Recorder()
+    users = [VirtualUser(app, seeding, f"bench{number}") for number in range(args.users)]
+    for user in users:
+        seed(user, args.subjects, args.grades)
+    db.execute("UPDATE users SET admin=1 WHERE username=?", [users[0].username])
+
+    # Only the scenarios are measured, with the latency
+    recorder = Recorder()
+    for user in users:
+        user.recorder = recorder
+    client.latency = args.latency / 1000
+    errors = [f"Seeding: {failure}" for failure in seeding.failures]
+
+    def run(user):
+        try:
+            for iteration in range(args.iterations):
+                scenario(user, iteration)
+        except Exception as e:
+            errors.append(f"{user.username}: {e!r}")
+
+    threads = [threading.Thread(target=run, args=(user,)) for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    requests = sum(len(samples) for samples in recorder.samples.values())
+    try:
+        for iteration in range(args.iterations):
+            admin_pass(users[0], iteration)
+    except Exception as e:
+        errors.append(f"{users[0].username} (admin): {e!r}")
+
+    print(
+        f"{args.users} users x {args.iterations} iterations, {args.driver} driver, "
+        f"{args.latency:g} ms per round trip\n"
+    )
+    report(recorder, requests, seconds)
+    db.close()
+    directory.cleanup()
+
+    if args.write_budgets:
+        budgets = json.loads(BUDGETS.read_text()) if BUDGETS.exists() else {}
+        for (method, route), samples in recorder.samples.items():
+            budget = budgets.setdefault(f"{method} {route}", {})
+            budget["statements"] = max(sample[1] for sample in samples)
+        BUDGETS.write_text(json.dumps(dict(sorted(budgets.items())), indent=2) + "\n")
+        print(f"\nWrote {BUDGETS}")
+
+    if args.check or errors:
+        routes = {
+            (method, rule.rule)
+            for rule in app.url_map.iter_rules()
+            if rule.endpoint.startswith("api_routes.")
+            for method in rule.methods - {"HEAD", "OPTIONS"}
+        }
+        budgets = json.loads(BUDGETS.read_text()) if BUDGETS.exists() else {}
+        problems = errors + (check(recorder, routes, budgets) if args.check else [])
+        if problems:
+            print("\nFAILED")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Check that the grade listings run a fixed number of statements.
+
+Loads the routes that list grades with their subject (and GET /overview)
+for one user, adds grades and loads them again. The statements of every
+request are counted by the instrumented ``db`` client
+(APIendpoints/metrics.py), with the response cache off. The check fails
+(exit status 1) when a route runs more statements with more grades, e.g.
+one subject lookup per grade, or more than its maximum below.
+
+Usage:
+    python benchmarks/check_statements.py [--subjects 4] [--grades 5,50]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_overview import populate
+
+# Route -> most statements allowed: the data version for the ETag and the
+# query itself
+MAX_STATEMENTS = {
+    "/grades": 2,
+    "/grades/{grade_id}": 2,
+    "/subjects/{subject_id}/grades": 2,
+    "/overview": 2,
+}
+
+
+def add_grades(path, count):
+    """Add ``count`` grades to every subject of user 1."""
+    con = sqlite3.connect(path)
+    for (subject_id,) in con.execute("SELECT id FROM subjects WHERE user_id=1").fetchall():
+        con.executemany(
+            "INSERT INTO grades (date, name, grade, weight, user_id, subject_id) VALUES ('2024-06-01', ?, ?, 1, 1, ?)",
+            [(f"Extra {number}", round(random.uniform(3, 6), 1), subject_id) for number in range(count)],
+        )
+    con.commit()
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subjects", type=int, default=4, help="subjects of the user")
+    parser.add_argument("--grades", default="5,50", help="grades per subject of each measurement")
+    args = parser.parse_args()
+
+    random.seed(1)
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "statements.db")
+    os.environ.update(
+        DB_DRIVER="sqlite",
+        DB_PATH=path,
+        CACHE_TTL="0",
+        HASH_WORKERS="0",
+    )
+    sizes = [int(value) for value in args.grades.split(",")]
+    populate(path, args.subjects, sizes[0])
+
+    from app import app
+    from APIendpoints.api import create_token
+    from APIendpoints.metrics import current_request_stats
+    from config import db
+
+    @app.after_request
+    def statements_header(response):
+        response.headers["X-Statements"] = str(current_request_stats().statements)
+        return response
+
+    client = app.test_client()
+    with app.app_context():
+        token = create_token("user1", 1)
+    headers = {"x-access-token": token}
+    grade_id, subject_id = db.execute("SELECT id, subject_id FROM grades WHERE user_id=1 LIMIT 1").rows[0]
+
+    def measure(grades):
+        counts = {}
+        for route in MAX_STATEMENTS:
+            response = client.get(route.format(grade_id=grade_id, subject_id=subject_id), headers=headers)
+            assert response.status_code == 200, (route, response.get_json())
+            counts[route] = int(response.headers["X-Statements"])
+        return grades, counts
+
+    measurements = [measure(sizes[0])]
+    for previous, grades in zip(sizes, sizes[1:]):
+        add_grades(path, grades - previous)
+        measurements.append(measure(grades))
+    db.close()
+    directory.cleanup()
+
+    print(f"{'route':<38}" + "".join(f"{f'{grades} grades':>12}" for grades, _ in measurements))
+    problems = []
+    for route, maximum in MAX_STATEMENTS.items():
+        counts = [counts[route] for _, counts in measurements]
+        print(f"{'GET ' + route:<38}" + "".join(f"{count:>12}" for count in counts))
+        if len(set(counts)) > 1:
+            problems.append(f"GET {route}: statements grow with the grades ({', '.join(map(str, counts))})")
+        if max(counts) > maximum:
+            problems.append(f"GET {route}: {max(counts)} statements, at most {maximum}")
+
+    if problems:
+        print("\nFAILED")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import os
-import sys
-from libsql_client import create_client_sync
 from dotenv import load_dotenv
+from storage import DRIVERS, LazyClient, create_storage
 
 load_dotenv()
 
@@ -17,34 +16,112 @@ ADMIN_API_KEYS = [
     "3d9a5cafeba42343dc1605c9004d9091fdc2a72a99c84bca0d4cc8c9ed2a483c",
 ]
 
+# Per-user response cache: seconds an entry stays valid and maximum number of entries
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 60))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 10000))
+
+# Verified JWT claims kept in memory (number of tokens) and seconds an admin
+# lookup stays cached
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+ADMIN_CACHE_TTL = int(os.environ.get("ADMIN_CACHE_TTL", 30))
+
+# Password hashing: werkzeug method (e.g. "pbkdf2:sha256:600000" or "scrypt"),
+# hashing processes (0 hashes on the request thread) and hashes allowed in flight
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256")
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", HASH_WORKERS * 4 or 4))
+
+# Apply pending schema migrations when the app starts (see migrations.py)
+AUTO_MIGRATE = os.environ.get("AUTO_MIGRATE", "").lower() in ("1", "true", "yes")
+
+# JSON serialization of the responses (see APIendpoints/serialization.py):
+# "auto" uses orjson when it is installed, "orjson" requires it, "default"
+# keeps Flask's standard library provider
+JSON_PROVIDER = os.environ.get("JSON_PROVIDER", "auto").lower()
+
+# Request metrics (see APIendpoints/metrics.py): requests and database calls
+# taking at least this many milliseconds are logged (0 logs none), and a
+# token that GET /metrics requires as "Authorization: Bearer <token>" (empty
+# leaves it open, e.g. when only the internal network reaches it)
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 0))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 0))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Profiles of requests that admins sent with the X-Profile header kept in
+# memory (see APIendpoints/profiling.py)
+PROFILE_HISTORY = int(os.environ.get("PROFILE_HISTORY", 20))
+
+# Threads serving the Flask app behind the ASGI entry point (see asgi.py)
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 200))
+
+# Storage driver (see storage.py): "turso" over HTTP, a local "sqlite" file or a
+# Turso embedded "replica" that reads from DB_PATH and syncs writes
+DB_DRIVER = os.environ.get("DB_DRIVER", "turso").lower()
+DB_PATH = os.environ.get("DB_PATH", "grades.db")
+DB_SYNC_INTERVAL = float(os.environ.get("DB_SYNC_INTERVAL", 0)) or None
+
+# Database connections per worker process, seconds an unused one stays open
+# and retries of a request that failed on a network error
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 64))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get("DB_POOL_IDLE_TIMEOUT", 60))
+DB_RETRIES = int(os.environ.get("DB_RETRIES", 2))
+
 # Turso database connection using HTTP client (works in serverless)
 url = os.environ.get("TURSO_DATABASE_URL") or os.environ.get("DB_URL")
 auth_token = os.environ.get("TURSO_AUTH_TOKEN") or os.environ.get("DB_AUTH_TOKEN")
 
-# Validate environment variables
-if not url:
-    print("ERROR: Database URL not found in environment variables.")
-    print("Please set TURSO_DATABASE_URL or DB_URL in your .env file")
-    sys.exit(1)
-
-if not auth_token:
-    print("ERROR: Database auth token not found in environment variables.")
-    print("Please set TURSO_AUTH_TOKEN or DB_AUTH_TOKEN in your .env file")
-    sys.exit(1)
-
-# Convert libsql:// or wss:// URLs to https:// for HTTP client
-if url.startswith("libsql://"):
-    url = url.replace("libsql://", "https://")
-elif url.startswith("wss://"):
-    url = url.replace("wss://", "https://")
-
-# Use synchronous HTTP-based client with error handling
-try:
-    db = create_client_sync(url=url, auth_token=auth_token)
-    print("Connected to Turso via HTTP")
-except Exception as e:
-    print(f"ERROR: Failed to create database connection: {e}")
-    sys.exit(1)
+
+def connect_db():
+    """
+    Validate the settings and create the database client.
+
+    Called on the first query through ``db``, so importing the app does not
+    open a connection. Raises ``RuntimeError`` when the settings are
+    incomplete or the client cannot be created.
+    """
+    if DB_DRIVER not in DRIVERS:
+        raise RuntimeError(
+            f"Unknown DB_DRIVER {DB_DRIVER!r}, expected one of {', '.join(DRIVERS)}"
+        )
+
+    # Validate environment variables, a local SQLite file needs neither
+    if DB_DRIVER != "sqlite":
+        if not url:
+            raise RuntimeError(
+                "Database URL not found in environment variables. "
+                "Please set TURSO_DATABASE_URL or DB_URL in your .env file"
+            )
+        if not auth_token:
+            raise RuntimeError(
+                "Database auth token not found in environment variables. "
+                "Please set TURSO_AUTH_TOKEN or DB_AUTH_TOKEN in your .env file"
+            )
+
+    # Create the client with error handling
+    try:
+        client = create_storage(
+            DB_DRIVER,
+            url=url,
+            auth_token=auth_token,
+            path=DB_PATH,
+            sync_interval=DB_SYNC_INTERVAL,
+            pool_size=DB_POOL_SIZE,
+            idle_timeout=DB_POOL_IDLE_TIMEOUT,
+            retries=DB_RETRIES,
+        )
+    except Exception as e:
+        raise RuntimeError(f"Failed to create database connection: {e}") from e
+
+    if DB_DRIVER == "turso":
+        print("Connected to Turso via HTTP")
+    elif DB_DRIVER == "sqlite":
+        print(f"Using local SQLite database {DB_PATH}")
+    else:
+        print(f"Using embedded replica {DB_PATH} of Turso")
+    return client
+
+
+db = LazyClient(connect_db)
 
 
 def close_db():
@@ -0,0 +1,27 @@
+"""Grade dates are stored as ISO ``yyyy-mm-dd`` text.
+
+ISO dates sort and compare like the calendar, so the database can order
+grades by date and range-scan the ``(user_id, date)`` index. Clients and
+schulNetz exports send ``dd.mm.yyyy``, which is converted on every write.
+"""
+import datetime
+
+# Accepted input formats, the first one is the stored form
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y")
+
+
+def normalize_date(value):
+    """
+    Convert a ``dd.mm.yyyy`` or ``yyyy-mm-dd`` date to ``yyyy-mm-dd``.
+
+    :param value: Date string as sent by a client.
+    :return: The ISO date string.
+    :raises ValueError: If the value is no valid date in either format.
+    """
+    if isinstance(value, str):
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(value.strip(), date_format).date().isoformat()
+            except ValueError:
+                continue
+    raise ValueError(f"Invalid date {value!r}, expected dd.mm.yyyy or yyyy-mm-dd")
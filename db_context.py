@@ -7,18 +7,18 @@ from config import db, close_db
 @contextmanager
 def db_connection():
     """
-    Context manager for database connections.
-    
+    Context manager for database access.
+
+    The shared client keeps its own connection pool, so leaving the block
+    does not close it; scripts close it once with ``close_db()`` or
+    ``execute_and_exit``.
+
     Usage:
-        with db_connection():
-            result = db.execute("SELECT * FROM users")
+        with db_connection() as client:
+            result = client.execute("SELECT * FROM users")
             # ... do work ...
-        # Connection is automatically closed when exiting the context
     """
-    try:
-        yield db
-    finally:
-        close_db()
+    yield db
 
 
 def execute_and_exit(func):
@@ -45,3 +45,63 @@ def execute_and_exit(func):
             close_db()
             sys.exit(1)
     return wrapper
+
+
+class StatementBatch:
+    """
+    Queue of statements sent to the database as a single ``db.batch()`` request.
+
+    The batch runs in one transaction: either every statement is applied or,
+    if one fails, none of them are.
+
+    Usage:
+        statements = StatementBatch()
+        insert = statements.add("INSERT INTO subjects (name, user_id) VALUES (?, ?)", [name, user_id])
+        statements.extend(other_statements)
+        results = statements.execute()
+        subject_id = results[insert].last_insert_rowid
+    """
+
+    def __init__(self, client=None):
+        self._client = client if client is not None else db
+        self.statements = []
+        self.results = []
+
+    def add(self, sql, args=None):
+        """Queue a statement and return its index in the results."""
+        self.statements.append((sql, args or []))
+        return len(self.statements) - 1
+
+    def extend(self, statements):
+        """Queue several ``(sql, args)`` tuples and return their result indices."""
+        return [self.add(sql, args) for sql, args in statements]
+
+    def execute(self):
+        """Send all queued statements in one round trip and return the results."""
+        if not self.statements:
+            self.results = []
+            return self.results
+        self.results = self._client.batch(self.statements)
+        self.statements = []
+        return self.results
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@contextmanager
+def batch(client=None):
+    """
+    Context manager that executes the queued statements when the block exits.
+
+    Nothing is sent if the block raises.
+
+    Usage:
+        with batch() as statements:
+            statements.add("DELETE FROM grades WHERE user_id=?", [user_id])
+            statements.add("DELETE FROM subjects WHERE user_id=?", [user_id])
+        print(statements.results)
+    """
+    statements = StatementBatch(client)
+    yield statements
+    statements.execute()
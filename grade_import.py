@@ -0,0 +1,197 @@
+"""Bulk grade import shared by ``POST /grades/bulk`` and ``seedDB.py``.
+
+Records are plain dicts with ``subject_name``, ``date``, ``name``, ``grade``,
+``weight`` and ``details``. They can come from a schulNetz export or from an
+NDJSON body (one record per line). All subjects, grades and the aggregate
+refresh are written in a single transactional batch.
+
+A transaction is one ``db.batch()`` request, so the whole import is held in
+memory until it is sent: records are parsed one by one and turned into
+multi-row INSERTs every ROWS_PER_INSERT rows, but the statements of all of
+them are sent together at the end.
+"""
+import json
+from config import db
+from db_context import StatementBatch
+from aggregates import aggregate_statements
+from dates import normalize_date
+
+# Rows per multi-row INSERT, keeps every statement well below SQLite's
+# bound parameter limit
+ROWS_PER_INSERT = 100
+
+GRADE_COLUMNS = "(date, name, grade, weight, details, user_id, subject_id)"
+
+
+def _group_number(key):
+    digits = "".join(char for char in key if char.isdigit())
+    return int(digits) if digits else 0
+
+
+def iter_schulnetz(data, skip_subjects=()):
+    """
+    Grade records of a schulNetz export, as an iterator.
+
+    The export lists the subject names under ``subjects`` and the grades per
+    subject under ``grades`` ("Subjekt 1", "Subjekt 2", ...) in the same order.
+    Subjects without grades have no entry in ``grades`` and must be named in
+    ``skip_subjects`` so the remaining entries line up.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Expected a schulNetz export object")
+    for key in ("subjects", "skip_subjects"):
+        names = data.get(key, [])
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise ValueError(f"{key} must be a list of subject names")
+    if not isinstance(skip_subjects, (list, tuple)):
+        raise ValueError("skip_subjects must be a list of subject names")
+    grades = data.get("grades") or {}
+    if not isinstance(grades, dict):
+        raise ValueError("grades must be an object of grade lists")
+    for name, group in grades.items():
+        if not isinstance(group, list):
+            raise ValueError(f"grades[{name!r}] must be a list of grades")
+
+    subjects = [
+        subject for subject in data.get("subjects", []) if subject not in skip_subjects
+    ]
+    # Order the groups by their number, JSON object key order is not reliable
+    groups = [
+        group for _, group in sorted(grades.items(), key=lambda item: _group_number(item[0]))
+    ]
+    if len(groups) > len(subjects):
+        raise ValueError("The export has more grade groups than subjects")
+    # Checked above rather than in the generator, so the errors are raised
+    # before import_grades reads the subjects
+    return _schulnetz_records(subjects, groups)
+
+
+def _schulnetz_records(subjects, groups):
+    for subject, group in zip(subjects, groups):
+        for grade in group:
+            # Other values are left to _grade_row, which reports their position
+            yield {**grade, "subject_name": subject} if isinstance(grade, dict) else grade
+
+
+def iter_ndjson(lines):
+    """Yield one grade record per non-empty line of NDJSON."""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode()
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {number}: invalid JSON ({e.msg})")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {number}: expected a JSON object")
+        yield record
+
+
+def _grade_row(record, position):
+    if not isinstance(record, dict):
+        raise ValueError(f"Record {position}: expected an object")
+    subject = record.get("subject_name")
+    if not subject:
+        raise ValueError(f"Record {position}: subject_name is required")
+    if not isinstance(subject, str):
+        raise ValueError(f"Record {position}: subject_name must be a string")
+    for key in ("date", "name", "grade", "weight", "details"):
+        if isinstance(record.get(key), (dict, list)):
+            raise ValueError(f"Record {position}: {key} must be a number or a string")
+    for key in ("date", "name"):
+        if record.get(key) in (None, ""):
+            raise ValueError(f"Record {position}: {key} is required")
+
+    try:
+        date = normalize_date(record["date"])
+    except ValueError as e:
+        raise ValueError(f"Record {position}: {e}")
+
+    grade = record.get("grade")
+    return subject, [
+        date,
+        record["name"],
+        0 if grade == "" else grade,
+        record.get("weight", 1),
+        record.get("details", ""),
+    ]
+
+
+def _insert_statement(user_id, rows):
+    """
+    Multi-row INSERT for ``(subject_id, subject_name, values)`` rows.
+
+    Rows of subjects created in the same batch have no id yet and look it up
+    by name instead.
+    """
+    values = []
+    args = []
+    for subject_id, subject, row in rows:
+        if subject_id is not None:
+            values.append("(?, ?, ?, ?, ?, ?, ?)")
+            args += [*row, user_id, subject_id]
+        else:
+            values.append(
+                "(?, ?, ?, ?, ?, ?, (SELECT id FROM subjects WHERE user_id=? AND name=? ORDER BY id DESC LIMIT 1))"
+            )
+            args += [*row, user_id, user_id, subject]
+    return f"INSERT INTO grades {GRADE_COLUMNS} VALUES {', '.join(values)}", args
+
+
+def import_grades(user_id, records, subjects=(), subject_weights=None):
+    """
+    Import grade records for a user in one transactional batch.
+
+    Existing subjects are resolved once by name, missing ones are created and
+    the aggregates are recomputed exactly once at the end.
+
+    :param user_id: Owner of the grades.
+    :param records: Iterable of grade records.
+    :param subjects: Subject names to create even if they have no grades.
+    :param subject_weights: Optional weight per new subject name.
+    :return: Summary dict with the number of grades and the created subjects.
+    """
+    subject_weights = subject_weights or {}
+    result = db.execute("SELECT id, name FROM subjects WHERE user_id=?", [user_id])
+    known = {}
+    for row in result.rows:
+        known.setdefault(row["name"], row["id"])
+
+    new_subjects = [name for name in dict.fromkeys(subjects) if name not in known]
+    # Grade INSERTs, built every ROWS_PER_INSERT records
+    inserts = []
+    rows = []
+    imported = 0
+    for position, record in enumerate(records, start=1):
+        subject, row = _grade_row(record, position)
+        if subject not in known and subject not in new_subjects:
+            new_subjects.append(subject)
+        rows.append((known.get(subject), subject, row))
+        imported += 1
+        if len(rows) == ROWS_PER_INSERT:
+            inserts.append(_insert_statement(user_id, rows))
+            rows = []
+    if rows:
+        inserts.append(_insert_statement(user_id, rows))
+
+    statements = StatementBatch()
+    created = {
+        name: statements.add(
+            "INSERT INTO subjects (name, weight, user_id) VALUES (?, ?, ?)",
+            [name, subject_weights.get(name, 1), user_id],
+        )
+        for name in new_subjects
+    }
+    statements.extend(inserts)
+    statements.extend(aggregate_statements(user_id))
+    results = statements.execute()
+
+    return {
+        "imported": imported,
+        "subjects_created": {
+            name: results[index].last_insert_rowid for name, index in created.items()
+        },
+    }
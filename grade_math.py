@@ -0,0 +1,307 @@
+"""Grade math shared by the API, the statistics and the benchmarks.
+
+The rules are those of the SQL in ``aggregates.py``: a subject's average is
+the weighted mean of its non-zero grades rounded to three decimals, its
+points are ``(average - 4) * 2`` above 4 and 0 otherwise, and the user
+totals weight the subjects that have grades by the subject weight. Values
+are rounded half away from zero like SQLite's ROUND, so a ``Gradebook``
+reproduces the stored aggregates and can answer "what if" questions
+without writing anything.
+
+Rows are small ``__slots__`` objects and the batch functions take plain
+iterables, so aggregating thousands of grades allocates little more than
+one object per grade.
+
+The ``to_int``/``to_float``/``to_str`` helpers convert values read from
+the database, whose drivers may return text or bytes for any column.
+"""
+import math
+from typing import Union
+
+Value = Union[None, str, int, float, bytes]
+
+
+def to_int(value: Value) -> int:
+    """Safely convert a Value to int."""
+    if value is None:
+        return 0
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, str):
+        return int(float(value)) if value else 0
+    if isinstance(value, bytes):
+        return int(value.decode()) if value else 0
+    return 0
+
+
+def to_float(value: Value) -> float:
+    """Safely convert a Value to float."""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        return float(value) if value else 0.0
+    if isinstance(value, bytes):
+        return float(value.decode()) if value else 0.0
+    return 0.0
+
+
+def to_str(value: Value) -> str:
+    """Safely convert a Value to str."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+def real(value):
+    """
+    Numeric value of a stored grade or weight, like SQLite's CAST AS REAL.
+
+    ``None`` stays ``None`` (NULL), text that is not a number counts as 0.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def round3(value):
+    """Round to three decimals, half away from zero like SQLite's ROUND."""
+    return math.copysign(math.floor(abs(value) * 1000 + 0.5) / 1000, value)
+
+
+def points_of(average):
+    """Points of a subject average, ``None`` for subjects without grades."""
+    if average is None:
+        return None
+    return round3((average - 4) * 2) if average > 4 else 0
+
+
+class GradeRow:
+    """One grade as far as the aggregates are concerned."""
+
+    __slots__ = ("subject_id", "grade", "weight")
+
+    def __init__(self, subject_id, grade, weight=1):
+        self.subject_id = subject_id
+        self.grade = real(grade)
+        self.weight = real(weight)
+
+
+class SubjectRow:
+    """A subject with its aggregates, the columns of the subjects table."""
+
+    __slots__ = ("id", "name", "weight", "average", "points", "num_exams")
+
+    def __init__(self, id, name, weight=1, average=None, points=None, num_exams=None):
+        self.id = id
+        self.name = name
+        self.weight = real(weight)
+        self.average = average
+        self.points = points
+        self.num_exams = num_exams
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SubjectSums:
+    """Running weighted sums of one subject's grades."""
+
+    __slots__ = ("total", "weight", "exams")
+
+    def __init__(self, total=0.0, weight=0.0, exams=0):
+        self.total = total
+        self.weight = weight
+        self.exams = exams
+
+    def add(self, grade, weight):
+        self.exams += 1
+        # Grades of 0 are placeholders, grades without weight do not count
+        if grade and weight is not None:
+            self.total += grade * weight
+            self.weight += weight
+
+    def copy(self):
+        return SubjectSums(self.total, self.weight, self.exams)
+
+    @property
+    def average(self):
+        if not self.exams:
+            return None
+        return round3(self.total / self.weight) if self.weight else 0
+
+
+def subject_sums(grades, sums=None):
+    """
+    Sum grades per subject in one pass.
+
+    :param grades: Iterable of ``GradeRow``.
+    :param sums: Subject id -> ``SubjectSums`` to add to; grades of other
+        subjects are ignored. A new dict keyed by the grades' subjects when None.
+    :return: The ``sums`` dict.
+    """
+    if not isinstance(grades, (list, tuple)):
+        grades = list(grades)
+    if sums is None:
+        sums = {grade.subject_id: SubjectSums() for grade in grades}
+    # SubjectSums.add inlined, this loop runs once per grade
+    for grade in grades:
+        subject = sums.get(grade.subject_id)
+        if subject is None:
+            continue
+        subject.exams += 1
+        if grade.grade and grade.weight is not None:
+            subject.total += grade.grade * grade.weight
+            subject.weight += grade.weight
+    return sums
+
+
+def user_totals(subjects):
+    """
+    Totals over the subjects, like the user columns.
+
+    :param subjects: Iterable of ``(average, points, num_exams, weight)``.
+    :return: ``(total_average, total_points, total_exams)``.
+    """
+    average_sum = weight_sum = points_sum = 0.0
+    exams = 0
+    for average, points, num_exams, weight in subjects:
+        if not num_exams:
+            continue
+        exams += num_exams
+        if weight is not None:
+            average_sum += average * weight
+            points_sum += points * weight
+            weight_sum += weight
+    return (round3(average_sum / weight_sum) if weight_sum else 0, points_sum, exams)
+
+
+def required_grade(reaches, low=1.0, high=6.0, step=0.01):
+    """
+    Smallest grade on the grid ``low, low + step, ..., high`` that reaches a goal.
+
+    :param reaches: Function of a grade, true when the goal is reached;
+        it must not turn false again for higher grades.
+    :return: The grade, or ``None`` when even ``high`` does not reach the goal.
+    """
+    steps = round((high - low) / step)
+    grade_at = lambda index: round(low + index * step, 6)
+    if not reaches(grade_at(steps)):
+        return None
+    # Bisect on the grid index, reaches(grade_at(found)) always holds
+    lowest, found = 0, steps
+    while lowest < found:
+        middle = (lowest + found) // 2
+        if reaches(grade_at(middle)):
+            found = middle
+        else:
+            lowest = middle + 1
+    return grade_at(found)
+
+
+class Gradebook:
+    """
+    A user's subjects and grades in memory, aggregated like the database does.
+
+    Subjects are keyed by id; subjects that only exist in a simulation get
+    negative ids.
+    """
+
+    def __init__(self, subjects=(), grades=()):
+        """
+        :param subjects: ``SubjectRow`` objects, their aggregates are ignored.
+        :param grades: ``GradeRow`` objects of these subjects.
+        """
+        self.subjects = {}
+        self.sums = {}
+        self._new_ids = 0
+        for subject in subjects:
+            self.add_subject(subject)
+        self.add_grades(grades)
+
+    def add_subject(self, subject):
+        self.subjects[subject.id] = subject
+        self.sums[subject.id] = SubjectSums()
+
+    def add_new_subject(self, name, weight=1):
+        """Add a subject that is not stored yet, its id is negative."""
+        self._new_ids -= 1
+        self.add_subject(SubjectRow(self._new_ids, name, weight))
+        return self._new_ids
+
+    def subject_id(self, name):
+        """Id of the subject with this name, or ``None``."""
+        for subject in self.subjects.values():
+            if subject.name == name:
+                return subject.id
+        return None
+
+    def add_grades(self, grades):
+        subject_sums(grades, self.sums)
+
+    def subject(self, subject_id):
+        """The subject with its aggregates, like the subject columns."""
+        subject = self.subjects[subject_id]
+        sums = self.sums[subject_id]
+        average = sums.average
+        return SubjectRow(
+            subject_id if subject_id > 0 else None,
+            subject.name,
+            subject.weight,
+            average,
+            points_of(average),
+            sums.exams or None,
+        )
+
+    def totals(self, replace=None):
+        """
+        User totals, optionally with the sums of one subject replaced.
+
+        :param replace: ``(subject_id, sums)`` used instead of the stored sums.
+        :return: Dict of ``total_average``, ``total_points`` and ``total_exams``.
+        """
+        rows = []
+        for subject_id, sums in self.sums.items():
+            if replace is not None and replace[0] == subject_id:
+                sums = replace[1]
+            average = sums.average
+            rows.append((average, points_of(average), sums.exams, self.subjects[subject_id].weight))
+        total_average, total_points, total_exams = user_totals(rows)
+        return {
+            "total_average": total_average,
+            "total_points": total_points,
+            "total_exams": total_exams,
+        }
+
+    def required_grade(self, subject_id, target, weight=1, scope="total", step=0.01):
+        """
+        Lowest grade of one more exam in a subject that reaches a target.
+
+        :param subject_id: Subject of the exam.
+        :param target: Average to reach.
+        :param weight: Weight of the exam.
+        :param scope: ``"total"`` for the total average, ``"subject"`` for
+            the subject's average.
+        :param step: Precision of the returned grade.
+        :return: The grade between 1 and 6, or ``None`` if out of reach.
+        """
+        weight = real(weight)
+
+        def reaches(grade):
+            sums = self.sums[subject_id].copy()
+            sums.add(grade, weight)
+            if scope == "subject":
+                return sums.average >= target
+            return self.totals(replace=(subject_id, sums))["total_average"] >= target
+
+        return required_grade(reaches, step=step)
@@ -0,0 +1,197 @@
+"""Grade statistics over time for ``GET /stats``.
+
+Everything is computed in one pass over the user's grades in date order:
+per-subject running sums give the cumulative averages at the end of every
+period, a second set of sums per period gives the period averages, and a
+sliding window gives the rolling average. The averages follow the rules of
+``aggregates.py`` (see ``grade_math.py``), so the last cumulative average
+equals the user's ``total_average``.
+
+Periods:
+    week      ISO week, e.g. "2024-W05"
+    month     e.g. "2024-03"
+    semester  school year halves, August to January is S1 and February to
+              July is S2, e.g. "2024/25-S1"
+"""
+import datetime
+from collections import deque
+from grade_math import SubjectSums, real, round3
+
+PERIODS = ("week", "month", "semester")
+
+# Width of the histogram buckets, grades go from 1 to 6
+HISTOGRAM_STEP = 0.5
+HISTOGRAM_BUCKETS = [1 + index * HISTOGRAM_STEP for index in range(11)]
+
+
+def period_of(date, period):
+    """Label of the period an ISO date belongs to, ``None`` for invalid dates."""
+    try:
+        day = datetime.date.fromisoformat(date)
+    except (TypeError, ValueError):
+        return None
+    if period == "week":
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "month":
+        return f"{day.year}-{day.month:02d}"
+    # The school year starts in August, its second semester in February
+    start_year = day.year if day.month >= 8 else day.year - 1
+    semester = 1 if day.month >= 8 or day.month == 1 else 2
+    return f"{start_year}/{(start_year + 1) % 100:02d}-S{semester}"
+
+
+class _Distribution:
+    """Best and worst grade and the histogram of the counted grades."""
+
+    __slots__ = ("best", "worst", "counts")
+
+    def __init__(self):
+        self.best = None
+        self.worst = None
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+
+    def add(self, grade, row):
+        # The rows are kept as they are, the summaries are built once at the end
+        if self.best is None or grade > self.best[0]:
+            self.best = (grade, row)
+        if self.worst is None or grade < self.worst[0]:
+            self.worst = (grade, row)
+        index = int((grade - HISTOGRAM_BUCKETS[0]) // HISTOGRAM_STEP)
+        self.counts[min(max(index, 0), len(HISTOGRAM_BUCKETS) - 1)] += 1
+
+    @staticmethod
+    def _summary(entry):
+        if entry is None:
+            return None
+        grade, row = entry
+        return {"id": row["id"], "name": row["name"], "date": row["date"], "grade": grade}
+
+    def as_dict(self):
+        return {
+            "best": self._summary(self.best),
+            "worst": self._summary(self.worst),
+            "histogram": {
+                f"{bucket:.1f}": count for bucket, count in zip(HISTOGRAM_BUCKETS, self.counts)
+            },
+        }
+
+
+def _overall(sums, subject_weights):
+    """Average over the subjects weighted by subject weight, like the user totals."""
+    total = weight = 0.0
+    for subject_id, subject_sums in sums.items():
+        average = subject_sums.average
+        subject_weight = subject_weights.get(subject_id)
+        if average is None or subject_weight is None:
+            continue
+        total += average * subject_weight
+        weight += subject_weight
+    return round3(total / weight) if weight else None
+
+
+def compute_stats(subjects, grades, period="semester", window=5):
+    """
+    Statistics of a user's grades.
+
+    :param subjects: Dicts with ``id``, ``name`` and ``weight`` of the subjects.
+    :param grades: Dicts with ``id``, ``subject_id``, ``name``, ``date``,
+        ``grade`` and ``weight``, ordered by date.
+    :param period: One of ``PERIODS``, the bucket size of the timelines.
+    :param window: Number of grades in the rolling average.
+    :return: Dict with the ``overall`` and per-subject statistics.
+    """
+    subject_weights = {subject["id"]: real(subject["weight"]) for subject in subjects}
+    running = {subject["id"]: SubjectSums() for subject in subjects}
+    distributions = {subject["id"]: _Distribution() for subject in subjects}
+    subject_timelines = {subject["id"]: [] for subject in subjects}
+    overall_distribution = _Distribution()
+    overall_timeline = []
+    rolling = []
+    recent = deque()
+    recent_total = recent_weight = 0.0
+    # Many grades share a date, so each date is parsed once
+    periods = {}
+
+    def close_period(label, period_sums):
+        overall_timeline.append(
+            {
+                "period": label,
+                "num_exams": sum(sums.exams for sums in period_sums.values()),
+                "average": _overall(period_sums, subject_weights),
+                "cumulative_average": _overall(running, subject_weights),
+            }
+        )
+        for subject_id, sums in period_sums.items():
+            subject_timelines[subject_id].append(
+                {
+                    "period": label,
+                    "num_exams": sums.exams,
+                    "average": sums.average,
+                    "cumulative_average": running[subject_id].average,
+                }
+            )
+
+    label = None
+    period_sums = {}
+    for row in grades:
+        subject_id = row["subject_id"]
+        if subject_id not in running:
+            continue
+        grade, weight, date = real(row["grade"]), real(row["weight"]), row["date"]
+
+        if date not in periods:
+            periods[date] = period_of(date, period)
+        if periods[date] != label and period_sums:
+            close_period(label, period_sums)
+            period_sums = {}
+        label = periods[date]
+
+        running[subject_id].add(grade, weight)
+        if label is not None:
+            if subject_id not in period_sums:
+                period_sums[subject_id] = SubjectSums()
+            period_sums[subject_id].add(grade, weight)
+        if not grade:
+            continue
+
+        distributions[subject_id].add(grade, row)
+        overall_distribution.add(grade, row)
+
+        if weight:
+            recent.append((grade, weight))
+            recent_total += grade * weight
+            recent_weight += weight
+            if len(recent) > window:
+                old_grade, old_weight = recent.popleft()
+                recent_total -= old_grade * old_weight
+                recent_weight -= old_weight
+            rolling.append(
+                {"date": date, "grade": grade, "average": round3(recent_total / recent_weight)}
+            )
+    if period_sums:
+        close_period(label, period_sums)
+
+    return {
+        "period": period,
+        "window": window,
+        "overall": {
+            "average": _overall(running, subject_weights),
+            "num_exams": sum(sums.exams for sums in running.values()),
+            **overall_distribution.as_dict(),
+            "timeline": overall_timeline,
+            "rolling": rolling,
+        },
+        "subjects": [
+            {
+                "id": subject["id"],
+                "name": subject["name"],
+                "weight": subject["weight"],
+                "average": running[subject["id"]].average,
+                "num_exams": running[subject["id"]].exams,
+                **distributions[subject["id"]].as_dict(),
+                "timeline": subject_timelines[subject["id"]],
+            }
+            for subject in subjects
+        ],
+    }
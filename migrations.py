@@ -0,0 +1,196 @@
+"""Versioned, idempotent schema migrations.
+
+Every migration runs in one transactional batch together with the row that
+records it in ``schema_migrations``, so a failed migration leaves no trace
+and is retried on the next run.
+
+Usage:
+    python migrations.py           # apply pending migrations
+    python migrations.py --status  # list applied and pending migrations
+"""
+import sys
+from config import db
+from db_context import StatementBatch
+from aggregates import aggregate_statements
+from dates import normalize_date
+
+CREATE_USERS_TABLE = """CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    total_average REAL,
+    total_points INTEGER,
+    total_exams INTEGER,
+    admin BOOLEAN DEFAULT FALSE
+)"""
+
+CREATE_SUBJECTS_TABLE = """CREATE TABLE IF NOT EXISTS subjects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    average REAL,
+    points INTEGER,
+    num_exams INTEGER,
+    weight REAL DEFAULT 1,
+    user_id INTEGER NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id)
+)"""
+
+CREATE_GRADES_TABLE = """CREATE TABLE IF NOT EXISTS grades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    grade FLOAT,
+    details TEXT,
+    weight REAL DEFAULT 1,
+    user_id INTEGER NOT NULL,
+    subject_id INTEGER NOT NULL,
+    FOREIGN KEY(user_id) REFERENCES users(id),
+    FOREIGN KEY(subject_id) REFERENCES subjects(id)
+)"""
+
+# A subject with the same name and user as an older one
+_DUPLICATE_SUBJECT = """EXISTS (
+    SELECT 1 FROM subjects older
+    WHERE older.user_id = subjects.user_id
+        AND older.name = subjects.name
+        AND older.id < subjects.id
+)"""
+
+
+def merge_duplicate_subjects(client):
+    """
+    Move the grades of duplicate subjects (same user and name) to the oldest
+    one and delete the duplicates, so the unique index can be created.
+    """
+    result = client.execute(
+        f"SELECT DISTINCT user_id FROM subjects WHERE {_DUPLICATE_SUBJECT}"
+    )
+    user_ids = [row["user_id"] for row in result.rows]
+    if not user_ids:
+        return []
+
+    statements = [
+        (
+            """UPDATE grades SET subject_id = (
+                SELECT MIN(keep.id) FROM subjects keep
+                JOIN subjects duplicate ON duplicate.user_id = keep.user_id
+                    AND duplicate.name = keep.name
+                WHERE duplicate.id = grades.subject_id
+            )
+            WHERE subject_id IN (SELECT id FROM subjects WHERE """
+            + _DUPLICATE_SUBJECT
+            + ")",
+            [],
+        ),
+        (f"DELETE FROM subjects WHERE {_DUPLICATE_SUBJECT}", []),
+    ]
+    for user_id in user_ids:
+        statements += aggregate_statements(user_id)
+    return statements
+
+
+def normalize_grade_dates(client):
+    """
+    Rewrite grade dates stored as ``dd.mm.yyyy`` in ISO form, one UPDATE per
+    distinct date. Dates that cannot be parsed are left as they are.
+    """
+    result = client.execute("SELECT DISTINCT date FROM grades WHERE date NOT LIKE '____-__-__'")
+    statements = []
+    for row in result.rows:
+        try:
+            iso_date = normalize_date(row["date"])
+        except ValueError:
+            print(f"Warning: Keeping unparseable grade date {row['date']!r}")
+            continue
+        statements.append(("UPDATE grades SET date = ? WHERE date = ?", [iso_date, row["date"]]))
+    return statements
+
+
+# (version, name, statements) where statements is a list of SQL strings or a
+# function taking the client and returning (sql, args) tuples
+MIGRATIONS = [
+    (1, "create tables", [CREATE_USERS_TABLE, CREATE_SUBJECTS_TABLE, CREATE_GRADES_TABLE]),
+    (2, "merge duplicate subjects", merge_duplicate_subjects),
+    (
+        3,
+        "add lookup indexes",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_grades_user_subject ON grades(user_id, subject_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_subjects_user_name ON subjects(user_id, name)",
+        ],
+    ),
+    (
+        4,
+        "add grade listing index",
+        ["CREATE INDEX IF NOT EXISTS idx_grades_user_id ON grades(user_id, id)"],
+    ),
+    (5, "store grade dates as ISO dates", normalize_grade_dates),
+    (
+        6,
+        "add grade date index",
+        ["CREATE INDEX IF NOT EXISTS idx_grades_user_date ON grades(user_id, date)"],
+    ),
+]
+
+
+def applied_versions(client=None):
+    """Versions already recorded in ``schema_migrations``."""
+    client = client if client is not None else db
+    client.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    result = client.execute("SELECT version FROM schema_migrations")
+    return {row["version"] for row in result.rows}
+
+
+def migrate(client=None):
+    """
+    Apply all pending migrations in order.
+
+    :return: List of the applied ``(version, name)`` pairs.
+    """
+    client = client if client is not None else db
+    done = applied_versions(client)
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version in done:
+            continue
+        if callable(statements):
+            statements = statements(client)
+        else:
+            statements = [(sql, []) for sql in statements]
+
+        migration = StatementBatch(client)
+        migration.extend(statements)
+        migration.add(
+            "INSERT INTO schema_migrations (version, name) VALUES (?, ?)",
+            [version, name],
+        )
+        migration.execute()
+        applied.append((version, name))
+    return applied
+
+
+if __name__ == "__main__":
+    from db_context import execute_and_exit
+
+    @execute_and_exit
+    def main():
+        if "--status" in sys.argv:
+            done = applied_versions()
+            for version, name, _ in MIGRATIONS:
+                print(f"{version:>3} {'applied' if version in done else 'pending'}  {name}")
+            return
+
+        applied = migrate()
+        for version, name in applied:
+            print(f"Applied migration {version}: {name}")
+        if not applied:
+            print("Database is up to date")
+
+    main()
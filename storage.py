@@ -0,0 +1,382 @@
+"""Storage drivers behind the shared ``db`` client.
+
+Every driver offers the interface of the libsql HTTP client the API was
+written against: ``execute(sql, args)`` and ``batch(statements)`` return
+``ResultSet`` objects whose rows can be indexed by position or column name,
+and ``close()`` releases the connections.
+
+Drivers (``DB_DRIVER`` in the environment):
+    turso    Turso over HTTP with the async libsql client, works in
+             serverless deployments (default)
+    sqlite   Local SQLite file in WAL mode with a pool of connections
+    replica  Turso embedded replica: reads from a local copy, writes go to
+             the primary and the copy is synced after each write
+
+All drivers keep a bounded pool per process: HTTP keep-alive connections
+for Turso, SQLite connections for the local drivers. Connections idle for
+longer than the idle timeout are closed, broken ones are replaced, and
+failed reads are retried on a fresh connection: on a transport error for
+Turso, on lock, I/O and closed connection errors for the SQLite drivers.
+
+The Turso client (``turso_client.py``, asyncio and aiohttp) is only
+imported when it is created, so importing this module (and ``config``)
+stays cheap for serverless cold starts.
+"""
+import sqlite3
+import threading
+import time
+
+DRIVERS = ("turso", "sqlite", "replica")
+
+_WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER")
+
+
+def is_write(sql):
+    return sql.lstrip().upper().startswith(_WRITE_PREFIXES)
+
+
+# Parts of the messages of SQLite errors that another attempt may not hit:
+# lock contention, I/O errors and closed or unusable connections
+_TRANSIENT_MESSAGES = ("locked", "busy", "disk i/o", "unable to open", "closed", "not open")
+
+
+def is_transient(error):
+    """
+    Whether a failed statement may succeed on another attempt (and
+    connection), as opposed to an error in the statement itself.
+    """
+    if isinstance(error, sqlite3.IntegrityError):
+        return False
+    if isinstance(error, OSError):
+        return True
+    message = str(error).lower()
+    return any(part in message for part in _TRANSIENT_MESSAGES)
+
+
+def _result_set(cursor):
+    """Convert a DB-API cursor into a libsql ``ResultSet``."""
+    from libsql_client.result import ResultSet, Row
+
+    columns = tuple(column[0] for column in cursor.description or ())
+    column_idxs = {name: index for index, name in enumerate(columns)}
+    rows = [Row(column_idxs, tuple(values)) for values in cursor.fetchall()]
+    return ResultSet(columns, rows, max(cursor.rowcount, 0), cursor.lastrowid)
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no pooled connection became free in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections.
+
+    Connections are handed out most recently used first, so under low load
+    the same few stay warm and the rest exceed ``idle_timeout`` and are
+    closed. A thread that finds all ``size`` connections checked out waits
+    up to ``timeout`` seconds for one to be returned.
+    """
+
+    def __init__(self, connect, size=8, idle_timeout=60, timeout=30):
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.opened = 0
+        self.evicted = 0
+        self.discarded = 0
+        self._idle = []
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def _evict_idle(self):
+        # The oldest connections are at the start of the list
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            connection, _ = self._idle.pop(0)
+            connection.close()
+            self.evicted += 1
+
+    def checkout(self):
+        with self._condition:
+            deadline = time.monotonic() + self.timeout
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    self._in_use += 1
+                    return connection
+                if self._in_use < self.size:
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection free after {self.timeout}s")
+                self._condition.wait(remaining)
+
+        try:
+            connection = self._connect()
+        except Exception:
+            self.release(None)
+            raise
+        with self._condition:
+            self.opened += 1
+        return connection
+
+    def release(self, connection, discard=False):
+        """Return a connection, or close it if it may be broken."""
+        with self._condition:
+            self._in_use -= 1
+            if connection is not None:
+                if discard:
+                    self.discarded += 1
+                else:
+                    self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+        if connection is not None and discard:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._condition:
+            return {
+                "pool_size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "opened": self.opened,
+                "evicted": self.evicted,
+                "discarded": self.discarded,
+            }
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+
+class DBAPIClient:
+    """
+    Client for pooled DB-API connections (``sqlite3`` and ``libsql``).
+
+    Reads failing with a transient error (see ``is_transient``) are retried
+    up to ``retries`` times, each on a fresh connection. Writes and batches
+    are not, since they may already have been applied. Other errors, such as
+    a constraint violation or an unknown column, are raised at once and
+    leave the connection in the pool.
+    """
+
+    def __init__(self, pool, retries=2):
+        self.pool = pool
+        self.retries = retries
+        self.retried = 0
+
+    def _after_write(self, connection):
+        """Hook run after statements that changed the database."""
+
+    def _run(self, work):
+        connection = self.pool.checkout()
+        try:
+            result = work(connection)
+        except Exception as e:
+            # After a transient error the connection may be broken, the next
+            # checkout opens a new one
+            self.pool.release(connection, discard=is_transient(e))
+            raise
+        self.pool.release(connection)
+        return result
+
+    def execute(self, sql, args=None):
+        write = is_write(sql)
+
+        def work(connection):
+            result = _result_set(connection.execute(sql, args or []))
+            if write:
+                self._after_write(connection)
+            return result
+
+        for attempt in range(self.retries + 1):
+            try:
+                return self._run(work)
+            except Exception as e:
+                # _run discarded the connection of a transient error, the
+                # retry opens a new one
+                if write or attempt == self.retries or not is_transient(e):
+                    raise
+                self.retried += 1
+
+    def batch(self, statements):
+        """Run ``(sql, args)`` tuples in one transaction, all or nothing."""
+
+        def work(connection):
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                results = [
+                    _result_set(connection.execute(sql, args or []))
+                    for sql, args in statements
+                ]
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self._after_write(connection)
+            return results
+
+        return self._run(work)
+
+    def stats(self):
+        return {**self.pool.stats(), "retried": self.retried}
+
+    def close(self):
+        self.pool.close()
+
+
+class ReplicaClient(DBAPIClient):
+    """Embedded replica that pulls the primary's changes after each write."""
+
+    def _after_write(self, connection):
+        connection.sync()
+
+
+def connect_sqlite(path):
+    """Open a local SQLite connection tuned for a small web server."""
+    connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA busy_timeout=5000")
+    return connection
+
+
+def create_storage(
+    driver,
+    url=None,
+    auth_token=None,
+    path=None,
+    sync_interval=None,
+    pool_size=64,
+    idle_timeout=60,
+    retries=2,
+):
+    """
+    Create the database client for a driver.
+
+    :param driver: One of ``DRIVERS``.
+    :param url: Turso database URL, for ``turso`` and ``replica``.
+    :param auth_token: Turso auth token, for ``turso`` and ``replica``.
+    :param path: Local database file, for ``sqlite`` and ``replica``.
+    :param sync_interval: Seconds between background syncs of a replica.
+    :param pool_size: Maximum connections of this process.
+    :param idle_timeout: Seconds before an unused connection is closed.
+    :param retries: Retries of a read (or an unsent Turso request) that failed.
+    :return: Client with ``execute``, ``batch``, ``stats`` and ``close``.
+    """
+    if driver == "turso":
+        from turso_client import AsyncLoopClient, PooledHttpClient
+
+        # Convert libsql:// or wss:// URLs to https:// for HTTP client
+        if url.startswith("libsql://"):
+            url = url.replace("libsql://", "https://")
+        elif url.startswith("wss://"):
+            url = url.replace("wss://", "https://")
+
+        def connect_turso():
+            if url.startswith(("https://", "http://")):
+                return PooledHttpClient(url, auth_token, pool_size, idle_timeout)
+            from libsql_client import create_client
+
+            return create_client(url, auth_token=auth_token)
+
+        return AsyncLoopClient(connect_turso, retries=retries)
+
+    if driver == "sqlite":
+        return DBAPIClient(ConnectionPool(lambda: connect_sqlite(path), pool_size, idle_timeout), retries)
+
+    if driver == "replica":
+        try:
+            import libsql
+        except ImportError:
+            raise RuntimeError("The replica driver needs the libsql package")
+
+        def connect_replica():
+            connection = libsql.connect(
+                path,
+                sync_url=url,
+                auth_token=auth_token,
+                sync_interval=sync_interval,
+                isolation_level=None,
+            )
+            connection.sync()
+            return connection
+
+        # The connections share the replica file, so a sync after a write on
+        # one of them is seen by all
+        return ReplicaClient(ConnectionPool(connect_replica, pool_size, idle_timeout), retries)
+
+    raise ValueError(f"Unknown DB_DRIVER {driver!r}, expected one of {', '.join(DRIVERS)}")
+
+
+class LazyClient:
+    """
+    Stand-in for the shared client that creates it on first use.
+
+    Modules can bind ``from config import db`` at import time while the
+    connection (and the import of the driver) waits for the first query,
+    so requests that never touch the database do not pay for it.
+    """
+
+    def __init__(self, create):
+        self._create = create
+        self._client = None
+        self._wrap = None
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._client is not None
+
+    def get(self):
+        """The underlying client, created on the first call."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._create()
+                    self._client = self._wrap(client) if self._wrap else client
+        return self._client
+
+    def set(self, client):
+        """Replace the underlying client, e.g. with one for tests or benchmarks."""
+        with self._lock:
+            self._client = self._wrap(client) if self._wrap else client
+
+    def wrap(self, wrapper):
+        """
+        Wrap the underlying client, e.g. to instrument it.
+
+        ``wrapper(client)`` is applied to the current client and to every
+        client created or set later.
+        """
+        with self._lock:
+            self._wrap = wrapper
+            if self._client is not None:
+                self._client = wrapper(self._client)
+
+    def execute(self, sql, args=None):
+        return self.get().execute(sql, args)
+
+    def batch(self, statements):
+        return self.get().batch(statements)
+
+    def stats(self):
+        return self.get().stats() if self._client is not None else {}
+
+    def close(self):
+        """Close the client if it was ever created."""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
@@ -1,23 +1,8 @@
 #!/usr/bin/env python3
 """Simple script to test database connection and queries"""
 import sys
-from typing import Union
 from config import db, close_db
-
-
-def to_int(value: Union[None, str, int, float, bytes]) -> int:
-    """Safely convert a Value to int."""
-    if value is None:
-        return 0
-    if isinstance(value, int):
-        return value
-    if isinstance(value, float):
-        return int(value)
-    if isinstance(value, str):
-        return int(float(value)) if value else 0
-    if isinstance(value, bytes):
-        return int(value.decode()) if value else 0
-    return 0
+from grade_math import to_int
 
 
 try:
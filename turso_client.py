@@ -0,0 +1,129 @@
+"""Turso client used by the ``turso`` storage driver.
+
+Kept apart from ``storage.py`` because asyncio, aiohttp and the libsql
+client are slow to import and only this driver needs them.
+"""
+import asyncio
+import threading
+import aiohttp
+from libsql_client import LibsqlError
+from libsql_client.http import HttpClient
+from storage import is_write
+
+# Errors where the request never reached the database, safe to retry writes too
+NOT_SENT_ERRORS = (aiohttp.ClientConnectorError,)
+# Errors where the request may or may not have been applied
+TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)
+
+
+class PooledHttpClient(HttpClient):
+    """
+    libsql HTTP client whose session keeps a bounded pool of keep-alive
+    connections to Turso. Must be created on the event loop that uses it.
+
+    :param pool_size: Maximum number of open connections, further requests wait.
+    :param idle_timeout: Seconds an unused connection is kept open.
+    :param timeout: Seconds a request may take before it fails.
+    """
+
+    def __init__(self, url, auth_token=None, pool_size=64, idle_timeout=60, timeout=30):
+        self._url = url
+        self._session = aiohttp.ClientSession(
+            headers={"authorization": f"Bearer {auth_token}"},
+            connector=aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=idle_timeout),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        )
+
+
+class AsyncLoopClient:
+    """
+    Blocking client over the async libsql client whose calls overlap.
+
+    libsql_client's own sync client awaits one statement after the other,
+    so a process never has more than one round trip to Turso in flight, no
+    matter how many threads serve requests. Here every call becomes its own
+    task on a shared event loop, so the round trips of all request threads
+    run concurrently. Coroutines can await ``execute_async`` and
+    ``batch_async`` instead.
+
+    Requests failing on a transport error are retried with backoff: always
+    if they never reached the server, otherwise only reads, since a write
+    may already have been applied. A client that was closed is recreated on
+    the next call.
+    """
+
+    def __init__(self, create, retries=2, backoff=0.1):
+        self._create_client = create
+        self.retries = retries
+        self.backoff = backoff
+        self.reconnects = 0
+        self.retried = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="libsql_client", daemon=True
+        )
+        self._thread.start()
+        self._client = self._run(self._create())
+
+    async def _create(self):
+        # The HTTP client binds its session to the loop it is created on
+        return self._create_client()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _await(self, coro):
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+
+    async def _call(self, method, statement, retry_sent):
+        for attempt in range(self.retries + 1):
+            if getattr(self._client, "closed", False):
+                self._client = await self._create()
+                self.reconnects += 1
+            try:
+                return await getattr(self._client, method)(*statement)
+            except TRANSPORT_ERRORS as e:
+                if attempt == self.retries or not (
+                    retry_sent or isinstance(e, NOT_SENT_ERRORS)
+                ):
+                    raise LibsqlError(f"Database unreachable: {e}", "TRANSPORT_ERROR") from e
+                self.retried += 1
+                await asyncio.sleep(self.backoff * 2**attempt)
+
+    def _execute(self, sql, args):
+        return self._call("execute", (sql, args), retry_sent=not is_write(sql))
+
+    def _batch(self, statements):
+        return self._call("batch", (statements,), retry_sent=False)
+
+    def execute(self, sql, args=None):
+        return self._run(self._execute(sql, args))
+
+    def batch(self, statements):
+        """Run ``(sql, args)`` tuples in one transaction, all or nothing."""
+        return self._run(self._batch(statements))
+
+    async def execute_async(self, sql, args=None):
+        return await self._await(self._execute(sql, args))
+
+    async def batch_async(self, statements):
+        return await self._await(self._batch(statements))
+
+    def stats(self):
+        stats = {"reconnects": self.reconnects, "retried": self.retried}
+        connector = getattr(getattr(self._client, "_session", None), "connector", None)
+        if connector is not None:
+            stats["pool_size"] = connector.limit
+        return stats
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        try:
+            self._run(self._client.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()